@@ -31,12 +31,25 @@ IMPORTANT NOTES:
       machines.  This is a second reason why you should run this test module
       there.
 """
+import json
 import os
+import time
+from array import array
+from typing import Optional, Tuple
 
+import pytest
 from hypothesis import given
 from hypothesis.strategies import integers
-from typing import Tuple
-from tm_trees import TMTree, FileSystemTree
+
+from tm_trees import TMTree, FileSystemTree, SQUARIFIED, build_tree
+import papers
+from papers import PaperTree, build_subtrees, regroup
+from fs_scanner import ProgressiveScan, load_snapshot, scan_file_system
+from compact_tree import compact_file_system, compact_tree
+from paper_store import PaperStore, convert_papers
+from tabular import MISSING, load_table
+from layouts import aspect_ratios, numpy_update_rectangles
+from name_search import NameIndex
 
 
 # This should be the path to the "workshop" folder in the sample data.
@@ -122,6 +135,750 @@ def test_example_data_rectangles() -> None:
         assert expected_rects[i] == actual_rects[i]
 
 
+def test_scan_matches_constructor() -> None:
+    """Test that the parallel scanner builds the same tree as the
+    FileSystemTree constructor.
+    """
+    expected = FileSystemTree(EXAMPLE_PATH)
+    for workers in [1, 4]:
+        tree, stats = scan_file_system(EXAMPLE_PATH, workers)
+        assert _same_shape(tree, expected)
+        assert tree._parent_tree is None
+        assert stats.files == 6
+        assert stats.folders == 3
+        assert stats.files_per_second() > 0
+
+
+def test_scan_snapshot(tmp_path) -> None:
+    """Test that a second scan loads unchanged folders from the snapshot,
+    and lists changed folders again.
+    """
+    root = tmp_path / 'root'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'a.txt').write_bytes(b'x' * 10)
+    (root / 'sub' / 'b.txt').write_bytes(b'x' * 5)
+    snapshot = str(tmp_path / 'root.snapshot')
+
+    first, stats = scan_file_system(str(root), 2, snapshot)
+    assert stats.cached_folders == 0
+    second, stats = scan_file_system(str(root), 2, snapshot)
+    assert stats.cached_folders == 2
+    assert _same_shape(first, second)
+
+    (root / 'sub' / 'c.txt').write_bytes(b'x' * 7)
+    third, stats = scan_file_system(str(root), 2, snapshot)
+    assert stats.cached_folders == 1
+    assert third.data_size == 22
+    assert _same_shape(third, FileSystemTree(str(root)))
+
+    # A snapshot whose parent column points past the end, or at a file, is
+    # unreadable.
+    with open(snapshot, 'rb') as snapshot_file:
+        data = snapshot_file.read()
+    count = int.from_bytes(data[16:24], 'little')
+    columns = array('q', data[24:24 + 32 * count])
+    file_index = list(columns[2 * count:3 * count]).index(-1)
+    for parent in [count + 5, file_index]:
+        columns[count - 1] = parent
+        with open(snapshot, 'wb') as snapshot_file:
+            snapshot_file.write(data[:24] + columns.tobytes() +
+                                data[24 + 32 * count:])
+        assert load_snapshot(snapshot, str(root)) is None
+
+    # So is one whose header claims more entries than the file holds.
+    with open(snapshot, 'wb') as snapshot_file:
+        snapshot_file.write(data[:16] + (2 ** 62).to_bytes(8, 'little') +
+                            data[24:])
+    assert load_snapshot(snapshot, str(root)) is None
+
+
+def test_lazy_scan() -> None:
+    """Test that a lazy scan only lists folders when they are expanded.
+    """
+    tree, stats = scan_file_system(EXAMPLE_PATH, 2, lazy=True)
+    assert stats.files == 6
+    assert tree.data_size == 151
+    assert tree._subtrees == []
+    assert tree.get_suffix() == ' (folder)'
+
+    listings = tree.get_listings()
+    tree.update_rectangles((0, 0, 200, 100))
+    assert tree.get_listings() == listings
+    tree.expand()
+    assert tree.get_listings() == listings + 1
+    assert len(tree._subtrees) == 3
+    assert len(tree.get_rectangles()) == 3
+    for subtree in tree._subtrees:
+        assert subtree._parent_tree is tree
+        assert subtree.rect != (0, 0, 0, 0)
+
+    tree.expand_all()
+    assert _same_shape(tree, FileSystemTree(EXAMPLE_PATH))
+
+
+def test_lazy_scan_changes(tmp_path) -> None:
+    """Test that an unlisted folder cannot be moved like a file, and that
+    listing a folder whose contents changed lays out its ancestors' other
+    subtrees again.
+    """
+    for folder in ['a', 'b']:
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / 'f.txt').write_bytes(b'x' * 10)
+    tree, _ = scan_file_system(str(tmp_path), 2, lazy=True)
+    tree.expand()
+    tree.update_rectangles((0, 0, 200, 100))
+    a, b = sorted(tree._subtrees, key=lambda t: t._name)
+    b.move(a)
+    assert b._parent_tree is tree and a.data_size == 10
+
+    (tmp_path / 'a' / 'g.txt').write_bytes(b'x' * 30)
+    a.expand()
+    assert tree.data_size == 50
+    incremental = _all_rects(tree)
+    tree.update_rectangles((0, 0, 200, 100))
+    assert _all_rects(tree) == incremental
+
+
+def test_scan_skips_folder_links(tmp_path) -> None:
+    """Test that a link back to an ancestor folder does not make a scan run
+    forever.
+    """
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'f.txt').write_bytes(b'x' * 10)
+    try:
+        os.symlink(str(tmp_path), str(tmp_path / 'a' / 'loop'),
+                   target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pytest.skip('symbolic links are not supported here')
+    for lazy in [False, True]:
+        tree, stats = scan_file_system(str(tmp_path), 2, lazy=lazy)
+        assert stats.files == 1
+        assert tree.data_size == 10
+    compact, _ = compact_file_system(str(tmp_path), workers=2)
+    assert compact.data_size == 10
+
+
+def test_progressive_scan() -> None:
+    """Test that a background scan ends with the same tree as the
+    FileSystemTree constructor.
+    """
+    scan = ProgressiveScan(EXAMPLE_PATH, 2)
+    assert scan.tree._name == 'workshop'
+    deadline = time.time() + 10
+    while not scan.is_done() and time.time() < deadline:
+        scan.poll()
+        time.sleep(0.01)
+    assert scan.is_done()
+    assert scan.stats.files == 6
+    assert scan.progress_text().startswith('Scanned')
+    assert _same_shape(scan.tree, FileSystemTree(EXAMPLE_PATH))
+
+
+def test_change_size_and_move_update_ancestors() -> None:
+    """Test that change_size and move keep the data_size of every ancestor
+    up to date without calling update_data_sizes.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    activities, draft, prep = tree._subtrees
+    leaf = activities._subtrees[0]
+
+    leaf.change_size(0.5)
+    assert leaf.data_size == 3
+    assert activities.data_size == 72
+    assert tree.data_size == 152
+    assert _sizes_consistent(tree)
+
+    leaf.move(prep)
+    assert leaf._parent_tree is prep
+    assert activities.data_size == 69
+    assert prep.data_size == 25
+    assert tree.data_size == 152
+    assert _sizes_consistent(tree)
+
+    draft.move(prep)
+    draft.change_size(-0.5)
+    assert prep.data_size == 54
+    assert tree.data_size == 123
+    assert _sizes_consistent(tree)
+
+
+def test_incremental_update_rectangles() -> None:
+    """Test that an incremental layout after an edit gives the same
+    rectangles as a full layout, and skips trees that did not change.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    tree.update_rectangles((0, 0, 200, 100))
+    activities, draft, prep = tree._subtrees
+
+    # Nothing changed, so nothing is laid out again.
+    leaf = prep._subtrees[0]
+    leaf.rect = (1, 2, 3, 4)
+    tree.update_rectangles((0, 0, 200, 100), incremental=True)
+    assert leaf.rect == (1, 2, 3, 4)
+    tree.update_rectangles((0, 0, 200, 100))
+
+    activities._subtrees[0].change_size(5.0)
+    activities._subtrees[1].move(prep)
+    tree.update_rectangles((0, 0, 200, 100), incremental=True)
+    expected = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(expected)
+    expected_activities, _, expected_prep = expected._subtrees
+    expected_activities._subtrees[0].change_size(5.0)
+    expected_activities._subtrees[1].move(expected_prep)
+    expected.update_rectangles((0, 0, 200, 100))
+    assert _all_rects(tree) == _all_rects(expected)
+
+
+def test_tree_at_position_index() -> None:
+    """Test that the indexed get_tree_at_position finds the same tree as a
+    linear search, including on shared edges, and after a move.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    tree.update_rectangles((0, 0, 200, 100))
+    tree.expand_all()
+    tree._subtrees[2]._subtrees[0].collapse()
+    for _ in range(2):
+        for x in range(-1, 202):
+            for y in range(-1, 102):
+                expected = _linear_tree_at_position(tree, (x, y))
+                assert tree.get_tree_at_position((x, y)) is expected
+        tree._subtrees[1].move(tree._subtrees[0])
+        tree.update_rectangles((0, 0, 200, 100), incremental=True)
+
+
+def test_get_rectangles_cached() -> None:
+    """Test that get_rectangles is only recomputed after the display
+    version changes.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    tree.update_rectangles((0, 0, 200, 100))
+    version = tree.get_version()
+    rects = tree.get_rectangles()
+    assert len(rects) == 1
+    assert tree.get_rectangles() is rects
+    assert tree.get_version() == version
+
+    tree.expand()
+    assert tree.get_version() != version
+    assert len(tree.get_rectangles()) == 3
+    tree.expand_all()
+    assert len(tree.get_rectangles()) == 6
+
+
+@given(integers(min_value=1, max_value=1000),
+       integers(min_value=1, max_value=1000))
+def test_numpy_layout_matches(width, height) -> None:
+    """Test that the NumPy layout engine gives the same rectangles as
+    update_rectangles.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    tree._subtrees[0]._subtrees[0].change_size(-0.5)
+    tree.update_rectangles((3, 4, width, height))
+    expected = _all_rects(tree)
+    tree.update_rectangles((0, 0, 0, 0))
+    numpy_update_rectangles(tree, (3, 4, width, height))
+    assert _all_rects(tree) == expected
+
+
+@given(integers(min_value=50, max_value=1000),
+       integers(min_value=50, max_value=1000))
+def test_squarified_layout(width, height) -> None:
+    """Test that the squarified layout tiles the whole rectangle with the
+    leaves, and that its rectangles are more square than slice-and-dice.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    tree.update_rectangles((0, 0, width, height))
+    slice_mean, _ = aspect_ratios(tree)
+
+    tree.set_layout(SQUARIFIED)
+    tree.update_rectangles((0, 0, width, height))
+    rects = [rect for rect, _ in tree.get_rectangles()]
+    assert sum(w * h for _, _, w, h in rects) == width * height
+    for i, (x1, y1, w1, h1) in enumerate(rects):
+        assert 0 <= x1 and x1 + w1 <= width
+        assert 0 <= y1 and y1 + h1 <= height
+        for x2, y2, w2, h2 in rects[i + 1:]:
+            assert (x1 + w1 <= x2 or x2 + w2 <= x1 or
+                    y1 + h1 <= y2 or y2 + h2 <= y1)
+    squarified_mean, _ = aspect_ratios(tree)
+    assert squarified_mean <= slice_mean
+
+    expected = _all_rects(tree)
+    numpy_update_rectangles(tree, (0, 0, width, height))
+    assert _all_rects(tree) == expected
+
+
+def test_set_layout_incremental() -> None:
+    """Test that an incremental update after set_layout lays out every tree
+    that uses the new layout, as a full update does.
+    """
+    # The folder fills the root in either layout, so only the layout of
+    # its files changes.
+    tree = build_tree(FileSystemTree, ['root', 'folder', 'a', 'b', 'c'],
+                      [0, 0, 1, 1, 1], [0, 0, 10, 30, 60])
+    tree.update_rectangles((0, 0, 400, 300))
+    tree.set_layout(SQUARIFIED)
+    tree.update_rectangles((0, 0, 400, 300), incremental=True)
+    incremental = _all_rects(tree)
+    tree.update_rectangles((0, 0, 400, 300))
+    assert _all_rects(tree) == incremental
+
+    tree._subtrees[0].set_layout(SQUARIFIED)
+    tree.set_layout(None)
+    tree.update_rectangles((0, 0, 400, 300), incremental=True)
+    incremental = _all_rects(tree)
+    tree.update_rectangles((0, 0, 400, 300))
+    assert _all_rects(tree) == incremental
+
+
+def test_min_size_culls_small_trees(monkeypatch) -> None:
+    """Test that, once a minimum size is set, a tree too small for its
+    subtrees is displayed as a single rectangle, and that its subtrees are
+    laid out again once it is large enough.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 200, 100))
+    leaves = len(tree.get_rectangles())
+    assert leaves > 1
+    tree.update_rectangles((0, 0, 1, 100))
+    assert len(tree.get_rectangles()) == leaves
+
+    monkeypatch.setattr(TMTree, '_min_size', 0)
+    FileSystemTree.set_min_size(2)
+    tree.update_rectangles((0, 0, 200, 100))
+    tree.update_rectangles((0, 0, 1, 100), incremental=True)
+    assert tree.get_rectangles() == [((0, 0, 1, 100), tree._colour)]
+    assert tree.get_tree_at_position((0, 50)) is tree
+    assert set(_all_rects(tree)[1:]) == {(0, 0, 0, 0)}
+    numpy_update_rectangles(tree, (0, 0, 200, 1))
+    assert tree.get_rectangles() == [((0, 0, 200, 1), tree._colour)]
+
+    tree.update_rectangles((0, 0, 200, 100), incremental=True)
+    assert len(tree.get_rectangles()) == leaves
+    assert tree.get_tree_at_position((0, 50)) is not tree
+
+
+def test_compact_tree_matches() -> None:
+    """Test that a compact tree is displayed and edited in the same way as
+    the FileSystemTree for the same folder, using much less memory.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    compact, stats = compact_file_system(EXAMPLE_PATH, workers=2)
+    assert (stats.files, stats.folders) == (6, 3)
+    assert compact.data_size == tree.data_size
+    assert compact._store.nbytes() < 100 * len(compact._store)
+    tree.expand_all()
+    compact.expand_all()
+    tree.update_rectangles((0, 0, 200, 100))
+    compact.update_rectangles((0, 0, 200, 100))
+    assert [rect for rect, _ in compact.get_rectangles()] == \
+        [rect for rect, _ in tree.get_rectangles()]
+
+    numpy_update_rectangles(compact, (0, 0, 200, 100))
+    assert [rect for rect, _ in compact.get_rectangles()] == \
+        [rect for rect, _ in tree.get_rectangles()]
+
+    for pos in [(x, y) for x in range(0, 201, 10) for y in range(0, 101, 5)]:
+        leaf = tree.get_tree_at_position(pos)
+        view = compact.get_tree_at_position(pos)
+        assert view is compact.get_tree_at_position(pos)
+        assert view.get_path_string() == leaf.get_path_string()
+        assert view.rect == leaf.rect
+
+    leaf = tree.get_tree_at_position((0, 0))
+    view = compact.get_tree_at_position((0, 0))
+    leaf.change_size(0.5)
+    view.change_size(0.5)
+    leaf.move(tree._subtrees[-1])
+    view.move(compact._store.node(compact._store._last[0]))
+    tree.update_rectangles((0, 0, 200, 100), incremental=True)
+    compact.update_rectangles((0, 0, 200, 100), incremental=True)
+    assert compact.data_size == tree.data_size
+    assert view.get_path_string() == leaf.get_path_string()
+    assert [rect for rect, _ in compact.get_rectangles()] == \
+        [rect for rect, _ in tree.get_rectangles()]
+
+
+def test_trees_use_slots() -> None:
+    """Test that trees keep their attributes in slots, without a dictionary
+    per instance.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    assert not hasattr(tree, '__dict__')
+    assert not hasattr(tree._subtrees[0], '__dict__')
+    lazy, _ = scan_file_system(EXAMPLE_PATH, lazy=True)
+    assert not hasattr(lazy, '__dict__')
+
+
+def test_build_tree() -> None:
+    """Test that build_tree links the nodes in order, adds up the sizes of
+    internal nodes, and gives the same colours every time.
+    """
+    names = ['root', 'a', 'b', 'c', 'd', 'e']
+    parents = [-1, 0, 0, 1, 1, 0]
+    sizes = [99, 99, 0, 5, 7, 3]
+    tree = build_tree(PaperTree, names, parents, sizes,
+                      {'_authors': [''] * 6, '_doi': [''] * 6})
+    assert isinstance(tree, PaperTree)
+    assert [subtree._name for subtree in tree._subtrees] == ['a', 'b', 'e']
+    assert [subtree._name for subtree in tree._subtrees[0]._subtrees] == \
+        ['c', 'd']
+    assert tree._subtrees[0]._subtrees[1]._parent_tree is tree._subtrees[0]
+    assert tree.data_size == 15
+    assert tree._subtrees[0].data_size == 12
+    assert tree._subtrees[1].data_size == 0
+    assert tree._subtrees[1]._subtrees == []
+    assert tree.get_separator() == ': '
+    assert _sizes_consistent(tree)
+
+    again = build_tree(PaperTree, names, parents, sizes,
+                       {'_authors': [''] * 6, '_doi': [''] * 6})
+    assert again._colour == tree._colour
+    assert is_valid_colour(tree._subtrees[2]._colour)
+
+
+def test_paper_tree_loader(tmp_path, monkeypatch) -> None:
+    """Test that papers with a common year and categories share the trees
+    for them, in the order they first appear in the data file.
+    """
+    data = tmp_path / 'papers.csv'
+    data.write_text(
+        'Author,Title,Year,Category,Url,Citations\r'
+        'A,P1,2001,X: Y,u1,5\r'
+        'B,P2,2002,X,u2,1\r'
+        'C,P3,2001,X: Z,u3,2\r'
+        'D,P4,2001,X: Y,u4,4\r')
+    monkeypatch.setattr(papers, 'DATA_FILE', str(data))
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    assert tree.data_size == 12
+    assert [year._name for year in tree._subtrees] == ['2001', '2002']
+    x = tree._subtrees[0]._subtrees[0]
+    assert [sub._name for sub in x._subtrees] == ['Y', 'Z']
+    assert [sub._name for sub in x._subtrees[0]._subtrees] == ['P1', 'P4']
+    assert x._subtrees[0].data_size == 9
+    paper = x._subtrees[0]._subtrees[1]
+    assert (paper._authors, paper._doi) == ('D', 'u4')
+    assert paper.get_path_string() == 'CS1: 2001: X: Y, P4 (paper)'
+    assert _sizes_consistent(tree)
+    assert _same_shape(tree, tree)
+
+    tree = PaperTree('CS1', [], all_papers=True, by_year=False)
+    assert [sub._name for sub in tree._subtrees] == ['X']
+    assert [sub._name for sub in tree._subtrees[0]._subtrees] == \
+        ['Y', 'P2', 'Z']
+
+
+def test_paper_records_cache(tmp_path, monkeypatch) -> None:
+    """Test that the parsed paper data is reused until the data file
+    changes, and that it can be loaded from the on-disk cache.
+    """
+    data = tmp_path / 'papers.csv'
+    data.write_text('Author,Title,Year,Category,Url,Citations\r'
+                    'A,P1,2001,X: Y,u1,5\r')
+    cache = str(tmp_path / 'papers.cache')
+    records = papers.load_records(str(data), cache)
+    assert records == [('A', 'P1', '2001', 'X: Y', 'u1', 5)]
+    assert papers.load_records(str(data), cache) is records
+
+    def fail(filename: str) -> None:
+        raise AssertionError('parsed ' + filename)
+
+    papers._records_cache.clear()
+    monkeypatch.setattr(papers, '_parse_records', fail)
+    assert papers.load_records(str(data), cache) == records
+    monkeypatch.undo()
+
+    data.write_text('Author,Title,Year,Category,Url,Citations\r'
+                    'A,P1,2001,X: Y,u1,5\r'
+                    'B,P2,2002,X,u2,10\r')
+    assert len(papers.load_records(str(data), cache)) == 2
+    papers._records_cache.clear()
+    assert len(papers.load_records(str(data), cache)) == 2
+
+    # A damaged cache is parsed again and replaced.
+    with open(cache, 'r+b') as cache_file:
+        cache_file.seek(-3, os.SEEK_END)
+        cache_file.truncate()
+    papers._records_cache.clear()
+    assert len(papers.load_records(str(data), cache)) == 2
+
+    # So is one whose count of records is damaged.
+    with open(cache, 'r+b') as cache_file:
+        cache_file.seek(16)
+        cache_file.write(array('q', [2 ** 62]).tobytes())
+    papers._records_cache.clear()
+    assert len(papers.load_records(str(data), cache)) == 2
+    papers._records_cache.clear()
+    monkeypatch.setattr(papers, '_parse_records', fail)
+    assert len(papers.load_records(str(data), cache)) == 2
+
+
+def test_paper_store(tmp_path, monkeypatch) -> None:
+    """Test that a paper store holds the same papers as its data file, and
+    that it can be filtered and aggregated.
+    """
+    data = tmp_path / 'papers.csv'
+    data.write_text(
+        'Author,Title,Year,Category,Url,Citations\r'
+        'A,P1,2001,X: Y,u1,5\r'
+        'B,P2,2002,X,u2,1\r'
+        'C,P3,2001,X: Z,u3,2\r'
+        'D,P4,2001,X: Y,u4,4\r')
+    store_file = str(tmp_path / 'papers.store')
+    assert convert_papers(str(data), store_file) == 4
+    store = PaperStore(store_file)
+    assert list(store.records()) == papers.load_records(str(data))
+
+    monkeypatch.setattr(papers, 'DATA_FILE', str(data))
+    for by_year in [True, False]:
+        tree = PaperTree('CS1', [], all_papers=True, by_year=by_year)
+        assert _same_shape(store.paper_tree('CS1', by_year), tree)
+
+    rows = store.select(min_year=2001, max_year=2001, min_citations=3)
+    assert rows.tolist() == [0, 3]
+    tree = store.category_tree('CS1', rows=rows)
+    assert [year._name for year in tree._subtrees] == ['2001']
+    assert [(leaf._name, leaf.data_size)
+            for leaf in tree._subtrees[0]._subtrees] == [('X: Y', 9)]
+    tree = store.category_tree('CS1', by_year=False)
+    assert [(leaf._name, leaf.data_size) for leaf in tree._subtrees] == \
+        [('X: Y', 9), ('X', 1), ('X: Z', 2)]
+    years = store.years[:2]
+    store.close()
+    assert years.tolist() == [2001, 2002]
+
+    with open(store_file, 'rb') as store_data:
+        damaged = store_data.read()[:100]
+    with open(store_file, 'wb') as store_data:
+        store_data.write(damaged)
+    with pytest.raises(ValueError):
+        PaperStore(store_file)
+
+
+def test_stream_paper_tree(tmp_path) -> None:
+    """Test that streaming a data file merges the papers with too few
+    citations into one leaf per category, in the order of the file.
+    """
+    data = tmp_path / 'papers.csv'
+    data.write_text(
+        'Author,Title,Year,Category,Url,Citations\r'
+        'A,P1,2001,X: Y,u1,5\r'
+        'B,P2,2002,X,u2,1\r'
+        'C,P3,2001,X: Z,u3,2\r'
+        'D,P4,2001,X: Y,u4,4\r'
+        'E,P5,2001,X: Y,u5,1\r')
+    updates = []
+    tree, stats = papers.stream_paper_tree('CS1', str(data), by_year=False,
+                                           min_citations=4, chunk_rows=2,
+                                           progress=updates.append)
+    assert (stats.rows, stats.kept, stats.merged) == (5, 2, 3)
+    assert len(updates) == 3
+    assert stats.rows_per_second() > 0
+    assert tree.data_size == 13
+    x = tree._subtrees[0]
+    assert [(sub._name, sub.data_size) for sub in x._subtrees] == \
+        [('Y', 10), (papers.OTHER, 1), ('Z', 2)]
+    assert [(sub._name, sub.data_size) for sub in x._subtrees[0]._subtrees] \
+        == [('P1', 5), ('P4', 4), (papers.OTHER, 1)]
+
+    tree, _ = papers.stream_paper_tree('CS1', str(data))
+    assert _same_shape(tree, PaperTree('CS1', build_subtrees(
+        papers.load_records(str(data)), True)))
+
+
+def test_regroup() -> None:
+    """Test that loaded papers can be grouped by any list of keys.
+    """
+    records = [('A and B', 'P1', '2001', 'X: Y', 'u1', 5),
+               ('C', 'P2', '2002', 'X', 'u2', 10),
+               ('A', 'P3', '2001', 'X: Z', 'u3', 0)]
+    tree = regroup('CS1', ['year', 'category'], records)
+    assert _same_shape(tree, PaperTree('CS1', build_subtrees(records, True)))
+
+    tree = regroup('CS1', ['category2', 'author'], records)
+    assert [sub._name for sub in tree._subtrees] == ['Y', papers.NO_VALUE,
+                                                     'Z']
+    assert [sub._name for sub in tree._subtrees[0]._subtrees] == ['A']
+    assert tree._subtrees[0]._subtrees[0]._subtrees[0]._name == 'P1'
+
+    tree = regroup('CS1', ['citations'], records)
+    assert [(sub._name, sub.data_size) for sub in tree._subtrees] == \
+        [('1-9', 5), ('10-99', 10), ('0', 0)]
+    assert _sizes_consistent(tree)
+    with pytest.raises(ValueError):
+        regroup('CS1', ['category0'], records)
+
+
+def test_load_table(tmp_path) -> None:
+    """Test that a table is grouped by its hierarchy columns, in the order
+    the groups first appear, from both CSV and JSON Lines files.
+    """
+    rows = [('infra', 'db', 2.5), ('web', 'cdn', 1), ('infra', 'logs', 4),
+            ('infra', 'db', 3), ('', 'misc', 7)]
+    csv_file = tmp_path / 'usage.csv'
+    csv_file.write_text('team,project,cost\n' + ''.join(
+        '{},{},{}\n'.format(*row) for row in rows))
+    jsonl_file = tmp_path / 'usage.jsonl'
+    jsonl_file.write_text(''.join(
+        json.dumps({'team': team, 'project': project, 'cost': cost}) + '\n'
+        for team, project, cost in rows))
+
+    for source in [csv_file, jsonl_file]:
+        tree = load_table(str(source), ['team', 'project'], 'cost', 'usage')
+        assert [(sub._name, sub.data_size) for sub in tree._subtrees] == \
+            [('infra', 10), ('web', 1), (MISSING, 7)]
+        assert [(sub._name, sub.data_size)
+                for sub in tree._subtrees[0]._subtrees] == \
+            [('db', 6), ('logs', 4)]
+        leaf = tree._subtrees[0]._subtrees[1]
+        assert leaf.get_path_string() == 'usage / infra / logs (project)'
+        assert _sizes_consistent(tree)
+        assert _same_shape(tree, tree)
+
+    csv_file.write_text('team,project,cost\nA,x,1\nB,y,1\nB,x,1\n')
+    tree = load_table(str(csv_file), ['team', 'project'], 'cost')
+    assert [sub._name for sub in tree._subtrees[1]._subtrees] == ['y', 'x']
+
+    csv_file.write_text('team,project,cost\nA,x,1\n\nB\nB,y,2\n\n')
+    tree = load_table(str(csv_file), ['team', 'project'], 'cost')
+    assert [(sub._name, sub.data_size) for sub in tree._subtrees] == \
+        [('A', 1), ('B', 2)]
+    assert [sub._name for sub in tree._subtrees[1]._subtrees] == \
+        [MISSING, 'y']
+
+    jsonl_file.write_text('{"team": "A", "cost": 1}\n')
+    for source in [csv_file, jsonl_file]:
+        with pytest.raises(ValueError):
+            load_table(str(source), ['team', 'owner'], 'cost')
+
+
+def test_get_tree_at_path() -> None:
+    """Test that trees are found by path, that the index and the cached path
+    strings follow a move, and that compact trees are found the same way.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    compact, _ = compact_file_system(EXAMPLE_PATH, workers=2)
+    for root in [tree, compact]:
+        assert root.get_tree_at_path('workshop') is root
+        assert root.get_tree_at_path('nothing') is None
+        leaf = root.get_tree_at_path(os.path.join('workshop', 'draft.pptx'))
+        assert leaf.get_path_string() == \
+            os.path.join('workshop', 'draft.pptx') + ' (file)'
+        folder = root.get_tree_at_path(os.path.join('workshop',
+                                                    'activities'))
+        assert folder.get_path_string(False) == \
+            os.path.join('workshop', 'activities')
+
+        leaf.move(folder)
+        moved = os.path.join('workshop', 'activities', 'draft.pptx')
+        assert leaf.get_path_string() == moved + ' (file)'
+        assert root.get_tree_at_path(moved) is leaf
+        assert root.get_tree_at_path(os.path.join('workshop',
+                                                  'draft.pptx')) is None
+
+
+def test_get_tree_at_path_index(tmp_path) -> None:
+    """Test that built trees are indexed by path as they are built, that a
+    tree with the same path as a moved tree is still found, and that the
+    path string of an empty folder changes once it is listed.
+    """
+    root = build_tree(FileSystemTree, ['root', 'a', 'a', 'folder', 'b'],
+                      [0, 0, 0, 0, 3], [0, 10, 20, 0, 30])
+    assert root._path_index is not None
+    first, second, folder = root._subtrees
+    assert root.get_tree_at_path(os.path.join('root', 'a')) is first
+    first.move(folder)
+    assert root.get_tree_at_path(os.path.join('root', 'a')) is second
+    assert root.get_tree_at_path(os.path.join('root', 'folder', 'a')) is first
+    # Only the root keeps the index.
+    assert all(subtree._root_state is None for subtree in root._subtrees)
+
+    records = [('Ann Lee', 'Loops', '2001', 'X: Y', 'u1', 5)]
+    tree = PaperTree('CS1', build_subtrees(records, True))
+    assert tree._path_index is not None
+    paper = tree._subtrees[0]._subtrees[0]._subtrees[0]._subtrees[0]
+    assert tree.get_tree_at_path('CS1: 2001: X: Y, Loops') is paper
+    assert tree.get_tree_at_path('CS1') is tree
+
+    records = [('Ann Lee', 'Loops', '2001', 'X: Y', 'u1', 5),
+               ('Bo Chan', 'Loops', '2001', 'X: Y', 'u2', 3),
+               ('Cy Dee', 'Sorting', '2001', 'X', 'u3', 1)]
+    tree = PaperTree('CS1', build_subtrees(records, True))
+    for root in [tree, compact_tree(tree)]:
+        first = root.get_tree_at_path('CS1: 2001: X: Y, Loops')
+        first.move(root.get_tree_at_path('CS1: 2001: X'))
+        second = root.get_tree_at_path('CS1: 2001: X: Y, Loops')
+        assert second is not None and second != first
+        assert root.get_tree_at_path('CS1: 2001: X, Loops') == first
+
+    (tmp_path / 'empty').mkdir()
+    lazy, _ = scan_file_system(str(tmp_path), 2, lazy=True)
+    lazy.expand()
+    empty = lazy._subtrees[0]
+    assert empty.get_path_string().endswith(' (folder)')
+    empty.expand()
+    assert empty.get_path_string().endswith(' (file)')
+
+
+def test_name_search() -> None:
+    """Test that trees are found by a substring or a prefix of their names,
+    ignoring case, before and after a move, and that papers are also found
+    by their authors.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    compact, _ = compact_file_system(EXAMPLE_PATH, workers=2)
+    for root in [tree, compact]:
+        index = NameIndex(root)
+        names = [match.get_search_names()[0]
+                 for match in index.search('.TXT')]
+        assert sorted(names) == ['a.txt', 'b.txt', 'c.txt', 'x.txt', 'y.txt']
+        assert len(index.search('.txt', limit=2)) == 2
+        assert [match.get_search_names()[0]
+                for match in index.search('a', prefix=True)] == \
+            ['a.txt', 'activities']
+        assert index.search('txt', prefix=True) == []
+        assert index.search('') == []
+
+        leaf = index.search('draft')[0]
+        leaf.move(index.search('prep', prefix=True)[0])
+        assert index.search('draft') == [leaf]
+
+    records = [('Ann Lee and Bo Chan', 'Loops', '2001', 'X: Y', 'u1', 5),
+               ('Cy Dee', 'Recursion', '2002', 'X', 'u2', 10)]
+    index = NameIndex(PaperTree('CS1', build_subtrees(records, True)))
+    assert [match._name for match in index.search('chan')] == ['Loops']
+    assert [match._name for match in index.search('x')] == ['X', 'X']
+
+
+def test_displayed_tree(monkeypatch) -> None:
+    """Test that a tree is shown by its highest collapsed or culled
+    ancestor, and by itself once all its ancestors are laid out.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    compact, _ = compact_file_system(EXAMPLE_PATH, workers=2)
+    for root in [tree, compact]:
+        path = os.path.join('workshop', 'activities')
+        folder = root.get_tree_at_path(path)
+        leaf = root.get_tree_at_path(os.path.join(path, 'c.txt'))
+        root.update_rectangles((0, 0, 200, 100))
+        assert root.get_displayed_tree() == root
+        assert leaf.get_displayed_tree() == root
+        root.expand()
+        assert leaf.get_displayed_tree() == folder
+        folder.expand()
+        assert leaf.get_displayed_tree() == leaf
+
+    monkeypatch.setattr(TMTree, '_min_size', 0)
+    FileSystemTree.set_min_size(2)
+    tree.update_rectangles((0, 0, 1, 100))
+    leaf = tree.get_tree_at_path(os.path.join(path, 'c.txt'))
+    assert leaf.get_displayed_tree() is tree
+
+
 ##############################################################################
 # Helpers
 ##############################################################################
@@ -137,6 +894,55 @@ def is_valid_colour(colour: Tuple[int, int, int]) -> bool:
     return True
 
 
+def _same_shape(tree1: TMTree, tree2: TMTree) -> bool:
+    """Return True iff <tree1> and <tree2> have the same names, data sizes
+    and subtree order at every level, and correct parent links.
+    """
+    if (tree1._name != tree2._name or tree1.data_size != tree2.data_size
+            or len(tree1._subtrees) != len(tree2._subtrees)):
+        return False
+    for sub1, sub2 in zip(tree1._subtrees, tree2._subtrees):
+        if sub1._parent_tree is not tree1 or not _same_shape(sub1, sub2):
+            return False
+    return True
+
+
+def _sizes_consistent(tree: TMTree) -> bool:
+    """Return True iff the data_size of every non-leaf tree in <tree> is
+    the sum of the data_size of its subtrees.
+    """
+    if tree._subtrees == []:
+        return True
+    return (tree.data_size == sum(sub.data_size for sub in tree._subtrees)
+            and all(_sizes_consistent(sub) for sub in tree._subtrees))
+
+
+def _all_rects(tree: TMTree) -> list:
+    """Return the rectangles of every tree in <tree>, in preorder.
+    """
+    rects = [tree.rect]
+    for subtree in tree._subtrees:
+        rects.extend(_all_rects(subtree))
+    return rects
+
+
+def _linear_tree_at_position(tree: TMTree,
+                             pos: Tuple[int, int]) -> Optional[TMTree]:
+    """Return the leaf in the displayed-tree rooted at <tree> whose
+    rectangle contains <pos>, by checking every subtree in order.
+    """
+    x, y, width, height = tree.rect
+    if not (x <= pos[0] <= x + width and y <= pos[1] <= y + height):
+        return None
+    elif tree._subtrees == [] or not tree._expanded:
+        return tree
+    for subtree in tree._subtrees:
+        result = _linear_tree_at_position(subtree, pos)
+        if result is not None:
+            return result
+    return None
+
+
 def _sort_subtrees(tree: TMTree) -> None:
     """Sort the subtrees of <tree> in alphabetical order.
     THIS IS FOR THE PURPOSES OF THE SAMPLE TEST ONLY; YOU SHOULD NOT SORT
@@ -0,0 +1,766 @@
+"""Compact array-backed trees for the treemap visualiser
+
+=== Module Description ===
+This module contains a tree store for trees with millions of nodes.
+
+Every TMTree is a full Python object: an instance dictionary, a rect tuple,
+a colour tuple, a list of subtrees and a parent pointer, which adds up to
+several hundred bytes per node before the name is even counted. A
+CompactTree keeps the same information for all of its nodes in a handful of
+typed arrays instead, one entry (or a few) per node, so that a node takes
+tens of bytes.
+
+The visualiser still works with TMTree objects. CompactTree.node returns a
+CompactNode: a small view of one node of the store that has the TMTree
+interface used by the visualiser. Views are only made for the nodes that are
+actually selected or pointed at; drawing, layout and hit testing run on the
+arrays directly.
+
+Compact trees always use the SLICE_AND_DICE layout. They can be built from
+the file system with compact_file_system, or from an existing tree with
+compact_tree.
+"""
+from __future__ import annotations
+import math
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+from weakref import WeakValueDictionary
+from tm_trees import TMTree, SLICE_AND_DICE
+from fs_scanner import DEFAULT_WORKERS, Entry, ScanStats, _iter_folders, \
+    _list_folder, _subfolders
+
+# The index used for "no node", e.g. as the parent of the root.
+NO_NODE = -1
+
+# The bits of CompactTree._flags.
+EXPANDED = 1
+DIRTY = 2
+CULLED = 4
+
+
+class CompactTree:
+    """The nodes of a tree, stored in typed arrays.
+
+    Node i is described by entry i of each array (entries 4 * i to
+    4 * i + 3 of _rects, and 3 * i to 3 * i + 2 of _colours). Node 0 is the
+    root. The subtrees of a node are kept as a linked list through _next, so
+    that a leaf can be moved without shifting any other node.
+
+    The separator and suffix of each node are recorded when it is added, so
+    the suffix of a node does not change if it loses all of its subtrees.
+
+    === Private Attributes ===
+    _names:
+        The names of all of the nodes, encoded as UTF-8, one after another.
+    _name_ends:
+        The offset in _names just past the name of each node.
+    _parents:
+        The parent of each node, or NO_NODE for the root.
+    _first:
+        The first subtree of each node, or NO_NODE for a leaf.
+    _last:
+        The last subtree of each node, or NO_NODE for a leaf.
+    _next:
+        The next sibling of each node, or NO_NODE.
+    _sizes:
+        The data_size of each node.
+    _rects:
+        The pygame rectangle of each node, four numbers per node.
+    _colours:
+        The RGB colour of each node, three bytes per node.
+    _flags:
+        The EXPANDED, DIRTY and CULLED bits of each node.
+    _styles:
+        The distinct (separator, suffix) pairs of the nodes.
+    _style_ids:
+        The index in _styles of the separator and suffix of each node.
+    _views:
+        The views of this store that are still in use, by node.
+    _path_index:
+        The nodes by path, as used by TMTree.get_tree_at_path, or None if
+        they have not been indexed yet.
+    _hit_indexes:
+        The subtrees of the nodes that _node_at has looked into since the
+        rectangles or the subtrees last changed, with an index of their
+        rectangles as in TMTree._build_hit_index, by node.
+
+    === Representation Invariants ===
+    - Every node has a smaller index than its subtrees, until a node is
+      moved.
+    - The data_size of a node with subtrees is the sum of theirs.
+    """
+    _names: bytearray
+    _name_ends: array
+    _parents: array
+    _first: array
+    _last: array
+    _next: array
+    _sizes: array
+    _rects: array
+    _colours: bytearray
+    _flags: bytearray
+    _styles: List[Tuple[str, str]]
+    _style_ids: bytearray
+    _views: WeakValueDictionary
+    _path_index: Optional[Dict[str, int]]
+    _hit_indexes: Dict[int, Tuple[List[int], Optional[int], List[int],
+                                  List[int]]]
+
+    def __init__(self) -> None:
+        """Initialize an empty store.
+        """
+        self._names = bytearray()
+        self._name_ends = array('I')
+        self._parents = array('i')
+        self._first = array('i')
+        self._last = array('i')
+        self._next = array('i')
+        self._sizes = array('q')
+        self._rects = array('i')
+        self._colours = bytearray()
+        self._flags = bytearray()
+        self._styles = []
+        self._style_ids = bytearray()
+        self._views = WeakValueDictionary()
+        self._path_index = None
+        self._hit_indexes = {}
+
+    def __len__(self) -> int:
+        """Return the number of nodes in this store.
+        """
+        return len(self._parents)
+
+    def nbytes(self) -> int:
+        """Return the number of bytes used by the arrays of this store.
+        """
+        total = len(self._names) + len(self._colours) + len(self._flags) + \
+            len(self._style_ids)
+        for numbers in [self._name_ends, self._parents, self._first,
+                        self._last, self._next, self._sizes,
+                        self._rects]:
+            total += len(numbers) * numbers.itemsize
+        return total
+
+    def node(self, index: int) -> CompactNode:
+        """Return the view of node <index>.
+
+        The same view is returned for as long as it is in use, so views of
+        the same node can be compared with "is".
+        """
+        view = self._views.get(index)
+        if view is None:
+            view = CompactNode(self, index)
+            self._views[index] = view
+        return view
+
+    def _add_node(self, parent: int, name: str, size: int,
+                  style: int) -> int:
+        """Add a node with the given <name>, <size> and <style> as the last
+        subtree of <parent>, and return its index.
+
+        The sizes of its ancestors are not updated; see _update_sizes.
+        """
+        index = len(self._parents)
+        self._names += name.encode('utf-8', 'surrogateescape')
+        self._name_ends.append(len(self._names))
+        self._parents.append(parent)
+        self._first.append(NO_NODE)
+        self._last.append(NO_NODE)
+        self._next.append(NO_NODE)
+        self._sizes.append(size)
+        self._rects.extend((0, 0, 0, 0))
+        self._colours += os.urandom(3)
+        self._flags.append(DIRTY)
+        self._style_ids.append(style)
+        if parent != NO_NODE:
+            self._link(index, parent)
+        return index
+
+    def _add_style(self, separator: str, suffix: str) -> int:
+        """Return the index in _styles of the pair (<separator>, <suffix>),
+        adding it if needed.
+        """
+        style = (separator, suffix)
+        if style not in self._styles:
+            self._styles.append(style)
+        return self._styles.index(style)
+
+    def _update_sizes(self) -> None:
+        """Set the size of every node with subtrees to the sum of the sizes
+        of its subtrees.
+
+        Precondition: every node has a smaller index than its subtrees.
+        """
+        parents = self._parents
+        sizes = self._sizes
+        for index in range(len(parents) - 1, 0, -1):
+            sizes[parents[index]] += sizes[index]
+
+    def _link(self, index: int, parent: int) -> None:
+        """Add node <index> as the last subtree of <parent>.
+        """
+        last = self._last[parent]
+        self._hit_indexes.clear()
+        self._parents[index] = parent
+        self._next[index] = NO_NODE
+        if last == NO_NODE:
+            self._first[parent] = index
+        else:
+            self._next[last] = index
+        self._last[parent] = index
+
+    def _unlink(self, index: int) -> None:
+        """Remove node <index> from the subtrees of its parent.
+        """
+        parent = self._parents[index]
+        self._hit_indexes.clear()
+        prev = NO_NODE
+        child = self._first[parent]
+        while child != index:
+            prev = child
+            child = self._next[child]
+        if prev == NO_NODE:
+            self._first[parent] = self._next[index]
+        else:
+            self._next[prev] = self._next[index]
+        if self._last[parent] == index:
+            self._last[parent] = prev
+        self._parents[index] = NO_NODE
+        self._next[index] = NO_NODE
+
+    def _path(self, index: int) -> str:
+        """Return the path of node <index>, as used by
+        TMTree.get_tree_at_path.
+        """
+        path = []
+        while index != NO_NODE:
+            path.append(index)
+            index = self._parents[index]
+        path.reverse()
+        path_str = self._name(path[0])
+        for index in path[1:]:
+            path_str += self._styles[self._style_ids[index]][0] + \
+                self._name(index)
+        return path_str
+
+    def _index_paths(self) -> Dict[str, int]:
+        """Return the index of every node by path, building it if needed.
+        """
+        if self._path_index is None:
+            index = {}
+            stack = [(0, self._name(0))]
+            while stack:
+                node, path = stack.pop()
+                index.setdefault(path, node)
+                for child in reversed(self._children(node)):
+                    stack.append((child, path +
+                                  self._styles[self._style_ids[child]][0] +
+                                  self._name(child)))
+            self._path_index = index
+        return self._path_index
+
+    def _children(self, index: int) -> List[int]:
+        """Return the subtrees of node <index>, in order.
+        """
+        children = []
+        child = self._first[index]
+        while child != NO_NODE:
+            children.append(child)
+            child = self._next[child]
+        return children
+
+    def _name(self, index: int) -> str:
+        """Return the name of node <index>.
+        """
+        start = self._name_ends[index - 1] if index > 0 else 0
+        return self._names[start:self._name_ends[index]].decode(
+            'utf-8', 'surrogateescape')
+
+    def _rect(self, index: int) -> Tuple[int, int, int, int]:
+        """Return the pygame rectangle of node <index>.
+        """
+        start = 4 * index
+        return tuple(self._rects[start:start + 4])
+
+    def _colour(self, index: int) -> Tuple[int, int, int]:
+        """Return the colour of node <index>.
+        """
+        start = 3 * index
+        return tuple(self._colours[start:start + 3])
+
+    def _update_rectangles(self, index: int, rect: Tuple[int, int, int, int],
+                           incremental: bool) -> None:
+        """Update the rectangles of node <index> and its descendants to fill
+        <rect>, as TMTree.update_rectangles does with SLICE_AND_DICE.
+        """
+        rects = self._rects
+        sizes = self._sizes
+        flags = self._flags
+        min_size = TMTree._min_size
+        self._hit_indexes.clear()
+        stack = [(index, rect)]
+        while stack:
+            index, rect = stack.pop()
+            start = 4 * index
+            if incremental and not flags[index] & DIRTY and \
+                    tuple(rects[start:start + 4]) == rect:
+                continue
+            flags[index] &= EXPANDED
+            if sizes[index] == 0:
+                continue
+            rects[start:start + 4] = array('i', rect)
+            x, y, width, height = rect
+            if self._first[index] == NO_NODE:
+                pass
+            elif width < min_size or height < min_size:
+                flags[index] |= CULLED
+                self._clear_rects(index)
+            else:
+                total = sizes[index]
+                wide = width > height
+                child = self._first[index]
+                while child != NO_NODE:
+                    proportion = sizes[child] / total
+                    if wide:
+                        new = proportion * width
+                    else:
+                        new = proportion * height
+                    if self._next[child] == NO_NODE:
+                        new = math.ceil(new)
+                    else:
+                        new = math.trunc(new)
+                    if wide:
+                        child_rect = (x, y, new, height)
+                        x += new
+                    else:
+                        child_rect = (x, y, width, new)
+                        y += new
+                    if sizes[child] == 0:
+                        rects[4 * child:4 * child + 4] = array('i',
+                                                               child_rect)
+                    else:
+                        stack.append((child, child_rect))
+                    child = self._next[child]
+
+    def _clear_rects(self, index: int) -> None:
+        """Set the rectangles of the descendants of node <index> to
+        (0, 0, 0, 0), as TMTree does for a culled tree.
+        """
+        rects = self._rects
+        empty = array('i', (0, 0, 0, 0))
+        stack = self._children(index)
+        while stack:
+            index = stack.pop()
+            if rects[4 * index:4 * index + 4] != empty:
+                rects[4 * index:4 * index + 4] = empty
+                stack.extend(self._children(index))
+
+    def _rectangles(self, index: int) -> List[Tuple[Tuple[int, int, int, int],
+                                                    Tuple[int, int, int]]]:
+        """Return the rectangles to display for node <index>, as
+        TMTree.get_rectangles does.
+        """
+        result = []
+        stack = [index]
+        while stack:
+            index = stack.pop()
+            if self._sizes[index] == 0:
+                pass
+            elif self._first[index] == NO_NODE or \
+                    self._flags[index] & (EXPANDED | CULLED) != EXPANDED:
+                result.append((self._rect(index), self._colour(index)))
+            else:
+                children = self._children(index)
+                children.reverse()
+                stack.extend(children)
+        return result
+
+    def _node_at(self, index: int, pos: Tuple[int, int]) -> int:
+        """Return the node displayed at <pos> in node <index>, as
+        TMTree.get_tree_at_position does, or NO_NODE.
+        """
+        x, y = pos
+        stack = [index]
+        while stack:
+            index = stack.pop()
+            start = 4 * index
+            left, top, width, height = self._rects[start:start + 4]
+            if not (left <= x <= left + width and top <= y <= top + height):
+                continue
+            elif self._first[index] == NO_NODE or \
+                    self._flags[index] & (EXPANDED | CULLED) != EXPANDED:
+                return index
+            hit_index = self._hit_indexes.get(index)
+            if hit_index is None:
+                hit_index = self._build_hit_index(index)
+                self._hit_indexes[index] = hit_index
+            children, axis, starts, ends = hit_index
+            if axis is None:
+                first = 0
+                last = len(children)
+            else:
+                # Only the subtrees that start before pos and end after it
+                # can contain it.
+                first = bisect_left(ends, pos[axis])
+                last = bisect_right(starts, pos[axis])
+            # The candidates are tried in order, as in
+            # TMTree.get_tree_at_position.
+            stack.extend(reversed(children[first:last]))
+        return NO_NODE
+
+    def _build_hit_index(self, index: int) -> Tuple[List[int], Optional[int],
+                                                    List[int], List[int]]:
+        """Return the subtrees of node <index>, together with an index of
+        their rectangles (axis, starts, ends) as in TMTree._build_hit_index.
+        """
+        children = self._children(index)
+        rects = self._rects
+        for axis in [0, 1]:
+            starts = []
+            ends = []
+            for child in children:
+                start = rects[4 * child + axis]
+                end = start + rects[4 * child + axis + 2]
+                if starts != [] and (start < starts[-1] or end < ends[-1]):
+                    break
+                starts.append(start)
+                ends.append(end)
+            else:
+                return children, axis, starts, ends
+        return children, None, [], []
+
+    def _add_size(self, index: int, change: int) -> None:
+        """Add <change> to the size of node <index> and of each of its
+        ancestors, and mark them all as dirty.
+        """
+        while index != NO_NODE:
+            self._sizes[index] += change
+            self._flags[index] |= DIRTY
+            index = self._parents[index]
+
+    def _set_expanded(self, index: int, expanded: bool) -> None:
+        """Expand or collapse node <index> and all of its descendants.
+
+        Leaves and empty nodes are never expanded.
+        """
+        stack = [index]
+        while stack:
+            index = stack.pop()
+            if expanded and (self._sizes[index] == 0 or
+                             self._first[index] == NO_NODE):
+                continue
+            if expanded:
+                self._flags[index] |= EXPANDED
+            else:
+                self._flags[index] &= ~EXPANDED
+            stack.extend(self._children(index))
+
+
+class CompactNode(TMTree):
+    """A view of a single node of a CompactTree, with the TMTree interface
+    used by the visualiser.
+
+    Views are made by CompactTree.node. Changes made through a view are
+    made to the store, so they are seen by every other view of it.
+
+    === Private Attributes ===
+    _store:
+        The store holding this node.
+    _index:
+        The index of this node in _store.
+    """
+    _store: CompactTree
+    _index: int
+    __slots__ = ('_store', '_index', '__weakref__')
+
+    def __init__(self, store: CompactTree, index: int) -> None:
+        """Initialize a view of node <index> of <store>.
+        """
+        self._store = store
+        self._index = index
+        self._root_state = None
+
+    @property
+    def rect(self) -> Tuple[int, int, int, int]:
+        """The pygame rectangle of this node.
+        """
+        return self._store._rect(self._index)
+
+    @property
+    def data_size(self) -> int:
+        """The data_size of this node.
+        """
+        return self._store._sizes[self._index]
+
+    @property
+    def _layout(self) -> str:
+        """The treemap algorithm of this node, which is always
+        SLICE_AND_DICE.
+        """
+        return SLICE_AND_DICE
+
+    def is_empty(self) -> bool:
+        """Return True iff this tree is empty.
+        """
+        return False
+
+    def update_rectangles(self, rect: Tuple[int, int, int, int],
+                          incremental: bool = False) -> None:
+        """Update the rectangles in this tree and its descendents using the
+        treemap algorithm to fill the area defined by pygame rectangle <rect>.
+        """
+        self._store._update_rectangles(self._index, tuple(rect), incremental)
+        self._touch()
+
+    def set_layout(self, layout: Optional[str]) -> None:
+        """Do nothing if <layout> is SLICE_AND_DICE or None.
+
+        Raise ValueError otherwise, since compact trees only support the
+        SLICE_AND_DICE layout.
+        """
+        if layout not in (None, SLICE_AND_DICE):
+            raise ValueError('compact trees only support the {} layout'
+                             .format(SLICE_AND_DICE))
+
+    def get_rectangles(self) -> List[Tuple[Tuple[int, int, int, int],
+                                           Tuple[int, int, int]]]:
+        """Return a list with tuples for every leaf in the displayed-tree
+        rooted at this tree, as TMTree.get_rectangles does.
+        """
+        if self._display_list is not None and \
+                self._display_list[0] == TMTree._version:
+            return self._display_list[1]
+        the_rect = self._store._rectangles(self._index)
+        self._display_list = TMTree._version, the_rect
+        return the_rect
+
+    def get_tree_at_position(self, pos: Tuple[int, int]
+                             ) -> Optional[CompactNode]:
+        """Return the leaf in the displayed-tree rooted at this tree whose
+        rectangle contains position <pos>, or None if <pos> is outside of this
+        tree's rectangle.
+        """
+        index = self._store._node_at(self._index, pos)
+        if index == NO_NODE:
+            return None
+        return self._store.node(index)
+
+    def update_data_sizes(self) -> int:
+        """Return the data_size of this tree, which is always up to date.
+        """
+        return self.data_size
+
+    def move(self, destination: CompactNode) -> None:
+        """If this tree is a leaf, and <destination> is not a leaf, move this
+        tree to be the last subtree of <destination>. Otherwise, do nothing.
+        """
+        store = self._store
+        index = self._index
+        target = destination._index
+        if store._first[index] == NO_NODE and \
+                store._first[target] != NO_NODE and \
+                store._parents[index] != NO_NODE:
+            size = store._sizes[index]
+            store._flags[index] |= DIRTY
+            store._add_size(store._parents[index], -size)
+            paths = store._path_index
+            if paths is not None:
+                path = store._path(index)
+                if paths.get(path) == index:
+                    del paths[path]
+                    # Another subtree of the parent with the same path takes
+                    # this node's place, as in TMTree._unindex_paths.
+                    style = store._styles[store._style_ids[index]][0]
+                    for child in store._children(store._parents[index]):
+                        if (child != index and
+                                store._name(child) == store._name(index) and
+                                store._styles[store._style_ids[child]][0] ==
+                                style):
+                            paths[path] = child
+                            break
+            store._unlink(index)
+            store._link(index, target)
+            if paths is not None:
+                paths.setdefault(store._path(index), index)
+            store._add_size(target, size)
+            self._touch()
+
+    def change_size(self, factor: float) -> None:
+        """Change the data_size of this tree by <factor>, as
+        TMTree.change_size does.
+        """
+        store = self._store
+        size = store._sizes[self._index]
+        if store._first[self._index] != NO_NODE or size == 0 or factor == 0:
+            return
+        if factor > 0:
+            new_size = math.ceil(size * (1 + factor))
+        else:
+            new_size = math.floor(size * (1 + factor))
+        if new_size >= 1:
+            store._add_size(self._index, new_size - size)
+            self._touch()
+
+    def expand(self) -> None:
+        """Expand this tree, unless it is a leaf.
+        """
+        store = self._store
+        if store._sizes[self._index] != 0 and \
+                store._first[self._index] != NO_NODE:
+            store._flags[self._index] |= EXPANDED
+            self._touch()
+
+    def expand_all(self) -> None:
+        """Expand this tree and all of its descendants.
+        """
+        self._store._set_expanded(self._index, True)
+        self._touch()
+
+    def collapse(self) -> None:
+        """Collapse the parent of this tree, and all of the parent's
+        descendants. If this tree is the root, do nothing.
+        """
+        parent = self._store._parents[self._index]
+        if parent != NO_NODE:
+            self._store._set_expanded(parent, False)
+            self._touch()
+
+    def collapse_all(self) -> None:
+        """Collapse the whole tree down to its root.
+        """
+        root = self._index
+        while self._store._parents[root] != NO_NODE:
+            root = self._store._parents[root]
+        self._store._set_expanded(root, False)
+        self._touch()
+
+    def get_path_string(self, final_node: bool = True) -> str:
+        """Return a string representing the path containing this tree
+        and its ancestors, as TMTree.get_path_string does.
+        """
+        path_str = self._store._path(self._index)
+        if final_node or self._store._first[self._index] == NO_NODE:
+            path_str += self.get_suffix()
+        return path_str
+
+    def get_tree_at_path(self, path: str) -> Optional[CompactNode]:
+        """Return the view of the node whose path is <path>, or None if
+        there is none, as TMTree.get_tree_at_path does.
+        """
+        index = self._store._index_paths().get(path)
+        if index is None:
+            return None
+        return self._store.node(index)
+
+    def get_displayed_tree(self) -> CompactNode:
+        """Return the view of the node whose rectangle shows this node in
+        the treemap, as TMTree.get_displayed_tree does.
+        """
+        store = self._store
+        displayed = self._index
+        index = store._parents[self._index]
+        while index != NO_NODE:
+            if store._flags[index] & (EXPANDED | CULLED) != EXPANDED:
+                displayed = index
+            index = store._parents[index]
+        if displayed == self._index:
+            return self
+        return store.node(displayed)
+
+    def get_search_names(self) -> List[str]:
+        """Return the names this tree can be found by with a
+        name_search.NameIndex.
+        """
+        return [self._store._name(self._index)]
+
+    def get_separator(self) -> str:
+        """Return the string used to separate names in the string
+        representation of a path from the tree root to this tree.
+        """
+        return self._store._styles[self._store._style_ids[self._index]][0]
+
+    def get_suffix(self) -> str:
+        """Return the string used at the end of the string representation of
+        a path from the tree root to this tree.
+        """
+        return self._store._styles[self._store._style_ids[self._index]][1]
+
+
+def compact_file_system(path: str, workers: int = DEFAULT_WORKERS
+                        ) -> Tuple[CompactNode, ScanStats]:
+    """Return the root of a compact tree for the file or folder at <path>,
+    together with statistics about the scan.
+
+    The tree has the same names, sizes and subtree order as
+    FileSystemTree(path). The folders are read on <workers> threads as in
+    fs_scanner.scan_file_system, and each listing is added to the store and
+    dropped as soon as it is read.
+
+    Precondition: <path> is a valid path for this computer, and workers >= 1.
+    """
+    stats = ScanStats(workers)
+    start = time.perf_counter()
+    store = CompactTree()
+    file_style = store._add_style(os.sep, ' (file)')
+    folder_style = store._add_style(os.sep, ' (folder)')
+
+    if not os.path.isdir(path):
+        stats.files = 1
+        store._add_node(NO_NODE, os.path.basename(path),
+                        os.path.getsize(path), file_style)
+    else:
+        folders = {path: store._add_node(NO_NODE, os.path.basename(path), 0,
+                                         folder_style)}
+
+        def read(folder: str) -> Tuple[List[Entry], List[str]]:
+            entries = _list_folder(folder)
+            return entries, _subfolders(entries)
+
+        for folder, entries in _iter_folders(path, workers, read):
+            parent = folders.pop(folder)
+            stats.folders += 1
+            for name, is_folder, size in entries:
+                if is_folder:
+                    child = os.path.join(folder, name)
+                    folders[child] = store._add_node(parent, name, 0,
+                                                     folder_style)
+                else:
+                    store._add_node(parent, name, size, file_style)
+                    stats.files += 1
+        store._update_sizes()
+
+    stats.seconds = time.perf_counter() - start
+    return store.node(0), stats
+
+
+def compact_tree(tree: TMTree) -> CompactNode:
+    """Return the root of a compact tree with the same names, sizes,
+    colours, separators, suffixes and subtree order as <tree>.
+
+    Precondition: <tree> is not empty.
+    """
+    store = CompactTree()
+    stack = [(tree, NO_NODE)]
+    while stack:
+        node, parent = stack.pop()
+        style = store._add_style(node.get_separator(), node.get_suffix())
+        index = store._add_node(parent, node._name, node.data_size, style)
+        store._colours[3 * index:3 * index + 3] = bytes(node._colour)
+        if node._expanded:
+            store._flags[index] |= EXPANDED
+        for subtree in reversed(node._subtrees):
+            stack.append((subtree, index))
+    return store.node(0)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'math', 'os', 'time', 'array', 'bisect',
+            'weakref', 'tm_trees', 'fs_scanner', '__future__'
+        ]
+    })
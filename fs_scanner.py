@@ -0,0 +1,707 @@
+"""Fast file system scanning for the treemap visualiser
+
+=== Module Description ===
+This module contains a scanner that builds the same FileSystemTree shape as
+the FileSystemTree constructor, but much faster on large folders.
+
+Instead of calling os.listdir and then os.path.isfile, os.path.isdir and
+os.path.getsize on every child, each folder is read once with os.scandir, and
+the type and size of each entry come from the (cached) DirEntry results.
+Symbolic links to folders are not followed, so a link back to one of its own
+ancestors cannot make a scan run forever; links to files are followed.
+Folder reads are spread over a bounded pool of worker threads, since most of
+the time is spent waiting on the disk rather than running Python code.
+
+A scan can also be given a snapshot file. After the scan, the folder listings
+are saved to it in a compact binary format, together with the modification
+time of each folder. The next scan of the same root reuses the saved listing
+of every folder whose modification time has not changed, and only lists the
+folders that did change. Note that changing the contents of a file does not
+change the modification time of its folder, so the size of a file that was
+rewritten in place is only picked up when something else in its folder
+changes.
+
+Finally, a scan can be lazy. A lazy scan only adds up the size of each
+folder, without creating any tree nodes, and returns a LazyFileSystemTree
+whose folders are listed the first time they are expanded. Memory use then
+grows with the part of the tree that the user has looked at.
+
+A ProgressiveScan runs the scan on background threads instead, so that the
+visualiser can show the part of the tree that has been read so far while the
+rest of the scan is still running.
+"""
+from __future__ import annotations
+import os
+import queue
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, \
+    TypeVar
+from tm_trees import TMTree, FileSystemTree, build_tree
+
+# The default number of worker threads used to read folders.
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# A single entry of a folder listing: (name, is_folder, size).
+# The size of a folder entry is always 0; it is computed from its contents.
+Entry = Tuple[str, bool, int]
+
+# A folder listing together with the modification time (in nanoseconds) of
+# the folder when it was listed.
+Listing = Tuple[int, List[Entry]]
+
+T = TypeVar('T')
+
+# The first bytes of every snapshot file.
+SNAPSHOT_MAGIC = b'TMSNAP01'
+
+
+class ScanStats:
+    """Statistics about a single scan of the file system.
+
+    === Public Attributes ===
+    files:
+        The number of files found.
+    folders:
+        The number of folders found, including the root folder.
+    seconds:
+        The wall-clock time taken by the scan, in seconds.
+    workers:
+        The number of worker threads used by the scan.
+    cached_folders:
+        The number of folders whose listing was reused from a snapshot.
+    """
+    files: int
+    folders: int
+    seconds: float
+    workers: int
+    cached_folders: int
+
+    def __init__(self, workers: int) -> None:
+        """Initialize empty statistics for a scan using <workers> threads.
+        """
+        self.files = 0
+        self.folders = 0
+        self.seconds = 0.0
+        self.workers = workers
+        self.cached_folders = 0
+
+    def files_per_second(self) -> float:
+        """Return the number of files scanned per second.
+        """
+        if self.seconds <= 0:
+            return float(self.files)
+        return self.files / self.seconds
+
+    def __str__(self) -> str:
+        """Return a one-line summary of this scan.
+        """
+        summary = '{} files, {} folders in {:.2f}s ({:.0f} files/sec, ' \
+                  '{} workers)'.format(self.files, self.folders, self.seconds,
+                                        self.files_per_second(), self.workers)
+        if self.cached_folders > 0:
+            summary += ', {} folders from snapshot'.format(self.cached_folders)
+        return summary
+
+
+def scan_file_system(path: str, workers: int = DEFAULT_WORKERS,
+                     snapshot: Optional[str] = None, lazy: bool = False
+                     ) -> Tuple[FileSystemTree, ScanStats]:
+    """Return a FileSystemTree for the file or folder at <path>, together
+    with statistics about the scan.
+
+    The tree has the same shape as FileSystemTree(path): the same names,
+    sizes and subtree order. Entries that are neither files nor folders
+    (e.g. broken symbolic links) are skipped.
+
+    If <snapshot> is not None, it is the path of a snapshot file. Unchanged
+    folders are loaded from it if it exists and was saved for the same
+    <path>, and it is rewritten with the result of this scan.
+
+    If <lazy> is True, return a LazyFileSystemTree instead. Only the folder
+    sizes are computed up front, and <snapshot> is not used.
+
+    Precondition: <path> is a valid path for this computer, and workers >= 1.
+    """
+    stats = ScanStats(workers)
+    start = time.perf_counter()
+
+    if not os.path.isdir(path):
+        stats.files = 1
+        tree = _make_node(os.path.basename(path), [], os.path.getsize(path))
+    elif lazy:
+        sizes = folder_sizes(path, workers, stats)
+        tree = LazyFileSystemTree(os.path.basename(path), path, sizes)
+    else:
+        cache = None
+        if snapshot is not None:
+            cache = load_snapshot(snapshot, path)
+        listings = _read_folders(path, workers, cache, stats)
+        tree = _build_tree(path, listings, stats)
+        if snapshot is not None:
+            save_snapshot(snapshot, path, listings)
+
+    stats.seconds = time.perf_counter() - start
+    return tree, stats
+
+
+def _list_folder(path: str) -> List[Entry]:
+    """Return the entries of the folder at <path>, in os.scandir order.
+
+    Entries that cannot be read are skipped, and so are symbolic links to
+    folders, since following them could visit a folder again and again.
+    """
+    entries = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.append((entry.name, True, 0))
+                    elif entry.is_file():
+                        entries.append((entry.name, False,
+                                        entry.stat().st_size))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return entries
+
+
+def _list_folder_cached(path: str, cache: Optional[Dict[str, Listing]]
+                        ) -> Tuple[Listing, bool]:
+    """Return the listing of the folder at <path>, and whether it was taken
+    from <cache>.
+
+    The cached listing is used only if the folder's modification time is
+    unchanged. The modification time is read *before* the folder is listed,
+    so that a change made during the listing is picked up by the next scan.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return (0, []), False
+    if cache is not None:
+        cached = cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached, True
+    return (mtime, _list_folder(path)), False
+
+
+def _walk_folders(root: str, workers: int,
+                  read: Callable[[str], Tuple[T, List[str]]]) -> Dict[str, T]:
+    """Return a mapping from the path of every folder under <root> (including
+    <root> itself) to the value returned by <read> for it, calling <read> on
+    <workers> threads.
+
+    <read> returns a value for the folder at the given path, and the names of
+    its subfolders. Every folder appears in the returned mapping after its
+    parent folder.
+    """
+    return dict(_iter_folders(root, workers, read))
+
+
+def _iter_folders(root: str, workers: int,
+                  read: Callable[[str], Tuple[T, List[str]]]
+                  ) -> Iterator[Tuple[str, T]]:
+    """Yield the path of every folder under <root> (including <root> itself)
+    together with the value returned by <read> for it, as in _walk_folders.
+
+    Every folder is yielded after its parent folder. The values are not kept,
+    so they can be used and dropped one folder at a time.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(read, root): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder = pending.pop(future)
+                value, subfolders = future.result()
+                for name in subfolders:
+                    child = os.path.join(folder, name)
+                    pending[pool.submit(read, child)] = child
+                yield folder, value
+
+
+def _read_folders(root: str, workers: int,
+                  cache: Optional[Dict[str, Listing]] = None,
+                  stats: Optional[ScanStats] = None) -> Dict[str, Listing]:
+    """Return a mapping from the path of every folder under <root> (including
+    <root> itself) to its listing, reading the folders on <workers> threads.
+
+    Listings of unchanged folders are taken from <cache>, if it is not None.
+    Count these folders in <stats>.
+    """
+    def read(path: str) -> Tuple[Tuple[Listing, bool], List[str]]:
+        listing, from_cache = _list_folder_cached(path, cache)
+        return (listing, from_cache), _subfolders(listing[1])
+
+    results = _walk_folders(root, workers, read)
+    listings = {}
+    for folder, (listing, from_cache) in results.items():
+        listings[folder] = listing
+        if from_cache and stats is not None:
+            stats.cached_folders += 1
+    return listings
+
+
+def _subfolders(entries: List[Entry]) -> List[str]:
+    """Return the names of the folders in <entries>.
+    """
+    return [name for name, is_folder, _ in entries if is_folder]
+
+
+def folder_sizes(root: str, workers: int = DEFAULT_WORKERS,
+                 stats: Optional[ScanStats] = None) -> Dict[str, int]:
+    """Return a mapping from the path of every folder under <root> (including
+    <root> itself) to the total size of the files in it and its subfolders.
+    Count the files and folders in <stats>.
+
+    No tree nodes or file listings are kept: only one total per folder.
+    """
+    def read(path: str) -> Tuple[Tuple[int, int, List[str]], List[str]]:
+        entries = _list_folder(path)
+        size = 0
+        files = 0
+        for _, is_folder, entry_size in entries:
+            if not is_folder:
+                size += entry_size
+                files += 1
+        subfolders = _subfolders(entries)
+        return (size, files, subfolders), subfolders
+
+    summaries = _walk_folders(root, workers, read)
+    totals = {}
+    # Every folder comes after its parent, so going backwards visits each
+    # folder after all of its subfolders.
+    for folder in reversed(list(summaries)):
+        size, files, subfolders = summaries[folder]
+        for name in subfolders:
+            size += totals[os.path.join(folder, name)]
+        totals[folder] = size
+        if stats is not None:
+            stats.files += files
+            stats.folders += 1
+    return totals
+
+
+def save_snapshot(snapshot: str, root: str,
+                  listings: Dict[str, Listing]) -> None:
+    """Save the folder <listings> of a scan of <root> to the file <snapshot>.
+
+    The file holds a header, then one record per file or folder in preorder:
+    the index of its parent (-1 for <root>), its size, the modification time
+    of the folder (-1 for files), and the length of its name. These are
+    stored as arrays of machine integers, followed by all of the names as one
+    UTF-8 blob. The file is replaced atomically.
+    """
+    parents = array('q')
+    sizes = array('q')
+    mtimes = array('q')
+    lengths = array('q')
+    names = []
+
+    def add(parent: int, name: str, size: int, mtime: int) -> int:
+        name_bytes = os.fsencode(name)
+        parents.append(parent)
+        sizes.append(size)
+        mtimes.append(mtime)
+        lengths.append(len(name_bytes))
+        names.append(name_bytes)
+        return len(parents) - 1
+
+    stack = [(root, add(-1, root, 0, listings[root][0]))]
+    while stack:
+        folder, index = stack.pop()
+        for name, is_folder, size in listings[folder][1]:
+            if is_folder:
+                child = os.path.join(folder, name)
+                stack.append((child, add(index, name, 0, listings[child][0])))
+            else:
+                add(index, name, size, -1)
+
+    header = SNAPSHOT_MAGIC + sys.byteorder.encode('ascii').ljust(8)
+    header += len(parents).to_bytes(8, 'little')
+    temp = snapshot + '.tmp'
+    with open(temp, 'wb') as snapshot_file:
+        snapshot_file.write(header)
+        for column in [parents, sizes, mtimes, lengths]:
+            column.tofile(snapshot_file)
+        snapshot_file.write(b''.join(names))
+    os.replace(temp, snapshot)
+
+
+def load_snapshot(snapshot: str, root: str) -> Optional[Dict[str, Listing]]:
+    """Return the folder listings saved in the file <snapshot> by a previous
+    scan of <root>.
+
+    Return None if the file does not exist, cannot be read, is damaged, or
+    was saved for a different root or on a machine with a different byte
+    order.
+    """
+    try:
+        with open(snapshot, 'rb') as snapshot_file:
+            header = snapshot_file.read(24)
+            if (len(header) != 24 or header[:8] != SNAPSHOT_MAGIC or
+                    header[8:16].strip() != sys.byteorder.encode('ascii')):
+                return None
+            count = int.from_bytes(header[16:], 'little')
+            # A damaged count must not make fromfile allocate more than the
+            # file can hold.
+            file_size = os.fstat(snapshot_file.fileno()).st_size
+            if count * 4 * array('q').itemsize > file_size - len(header):
+                return None
+            columns = []
+            for _ in range(4):
+                column = array('q')
+                column.fromfile(snapshot_file, count)
+                columns.append(column)
+            blob = snapshot_file.read()
+    except (OSError, EOFError):
+        return None
+
+    parents, sizes, mtimes, lengths = columns
+    if len(blob) != sum(lengths):
+        return None
+
+    listings = {}
+    paths = {}
+    offset = 0
+    for i in range(count):
+        name = os.fsdecode(blob[offset:offset + lengths[i]])
+        offset += lengths[i]
+        if parents[i] == -1:
+            if i != 0 or name != root:
+                return None
+            paths[i] = root
+            listings[root] = (mtimes[i], [])
+        elif parents[i] not in paths:
+            # Every parent is a folder that comes before its entries.
+            return None
+        else:
+            parent_path = paths[parents[i]]
+            is_folder = mtimes[i] != -1
+            listings[parent_path][1].append((name, is_folder, sizes[i]))
+            if is_folder:
+                path = os.path.join(parent_path, name)
+                paths[i] = path
+                listings[path] = (mtimes[i], [])
+    return listings
+
+
+def _build_tree(root: str, listings: Dict[str, Listing],
+                stats: Optional[ScanStats] = None) -> FileSystemTree:
+    """Return the FileSystemTree for the folder <root>, built in one pass
+    with build_tree from the folder <listings>. Count the files and folders
+    in <stats>.
+
+    Precondition: <listings> contains every folder under <root>.
+    """
+    names = [os.path.basename(root)]
+    parents = [0]
+    sizes = [0]
+    # The folders in the order they are numbered, each with its index. The
+    # list grows as it is read, so that each folder's entries are numbered
+    # after the folder itself.
+    folders = [(root, 0)]
+    for folder, index in folders:
+        for name, is_folder, size in listings[folder][1]:
+            if is_folder:
+                folders.append((os.path.join(folder, name), len(names)))
+            names.append(name)
+            parents.append(index)
+            sizes.append(size)
+    if stats is not None:
+        stats.folders += len(folders)
+        stats.files += len(names) - len(folders)
+    return build_tree(FileSystemTree, names, parents, sizes)
+
+
+class LazyFileSystemTree(FileSystemTree):
+    """A FileSystemTree whose folders are listed only when they are first
+    expanded.
+
+    Until then, a folder has no subtrees, and its data_size is its total size
+    from a previous size-only pass over the file system. Expanding a folder
+    (with expand, expand_all, or by moving a file into it) lists it and
+    creates its subtrees. Since get_tree_at_position only visits the subtrees
+    of expanded trees, it never needs a folder that has not been listed.
+
+    === Private Attributes ===
+    _path:
+        The full path of this folder if it has not been listed yet, or None
+        if this tree is a file or an already listed folder.
+    _folder_sizes:
+        The total sizes of the folders that do not have a tree yet, by path.
+        This mapping is shared by the whole tree, and each entry is removed
+        once the tree for its folder is created.
+    """
+    _path: Optional[str]
+    _folder_sizes: Dict[str, int]
+    __slots__ = ('_path', '_folder_sizes')
+
+    # The number of folders listed so far, shared by all lazy trees.
+    _listings = 0
+
+    def __init__(self, name: str, path: Optional[str],
+                 folder_sizes: Dict[str, int], data_size: int = 0) -> None:
+        """Initialize a new LazyFileSystemTree called <name>.
+
+        If <path> is None, this tree is a file of size <data_size>.
+        Otherwise, it is the folder at <path>, whose size is taken from
+        <folder_sizes>.
+        """
+        if path is not None:
+            data_size = folder_sizes.pop(path, 0)
+        TMTree.__init__(self, name, [], data_size)
+        self._path = path
+        self._folder_sizes = folder_sizes
+
+    def get_listings(self) -> int:
+        """Return the number of folders listed so far by any lazy tree.
+
+        This only changes when trees are added by listing a folder, unlike
+        the display version, which changes with every layout.
+        """
+        return LazyFileSystemTree._listings
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+        """
+        if self._path is not None:
+            return ' (folder)'
+        return FileSystemTree.get_suffix(self)
+
+    def expand(self) -> None:
+        """List this folder if needed, then expand it as a FileSystemTree.
+        """
+        self._load()
+        FileSystemTree.expand(self)
+
+    def expand_all(self) -> None:
+        """List this folder and all of its subfolders if needed, then expand
+        them as a FileSystemTree.
+        """
+        self._load()
+        FileSystemTree.expand_all(self)
+
+    def move(self, destination: TMTree) -> None:
+        """List <destination> if needed, then move this tree into it as a
+        FileSystemTree. Do nothing if this tree is a folder, even one that
+        has not been listed.
+        """
+        if self._path is not None:
+            return
+        if isinstance(destination, LazyFileSystemTree):
+            destination._load()
+        FileSystemTree.move(self, destination)
+
+    def change_size(self, factor: float) -> None:
+        """Change the size of this tree by <factor> if it is a file.
+        Do nothing if it is a folder, even one that has not been listed.
+        """
+        if self._path is None:
+            FileSystemTree.change_size(self, factor)
+
+    def _load(self) -> None:
+        """Create the subtrees of this folder if it has not been listed yet,
+        and lay them out inside this tree's rectangle.
+
+        If the folder changed since its size was computed, update the sizes
+        of this tree and its ancestors to match its new contents, and lay out
+        again the trees whose rectangles change.
+        """
+        if self._path is None:
+            return
+        path = self._path
+        self._path = None
+        LazyFileSystemTree._listings += 1
+        # Its suffix changes now that it is listed, even if it is empty.
+        self._path_string = None
+        for name, is_folder, size in _list_folder(path):
+            if is_folder:
+                child = LazyFileSystemTree(name, os.path.join(path, name),
+                                           self._folder_sizes)
+            else:
+                child = LazyFileSystemTree(name, None, self._folder_sizes,
+                                           size)
+            self._add_subtree(child)
+
+        change = sum(subtree.data_size for subtree in self._subtrees) - \
+            self.data_size
+        if change != 0:
+            # The rectangles of the ancestors' other subtrees change too.
+            self._add_size(change)
+            root = self._get_root()
+            root.update_rectangles(root.rect, incremental=True)
+        elif self._subtrees:
+            self.update_rectangles(self.rect)
+
+
+class ProgressiveScan:
+    """A scan of the file system that runs on background threads, and whose
+    results are added to a FileSystemTree as they arrive.
+
+    The background threads only read folders. The tree itself is only
+    changed by poll, so it is safe to display and edit the tree on the thread
+    that calls poll while the scan is running.
+
+    Folders that have been found but not read yet are in the tree as empty
+    folders of size 0, so they are not displayed until their contents arrive.
+
+    === Public Attributes ===
+    tree:
+        The tree of everything scanned so far.
+    stats:
+        Statistics about everything scanned so far.
+
+    === Private Attributes ===
+    _root:
+        The path of the root folder of the scan.
+    _results:
+        The folder listings read by the background threads that have not been
+        added to the tree yet, as (path, entries) pairs. None marks the end of
+        the scan.
+    _folders:
+        The trees for the folders that have been found but not read yet,
+        by path.
+    _start:
+        The time at which the scan started, from time.perf_counter.
+    _done:
+        Whether the whole scan has been added to the tree.
+    _stopped:
+        Whether the scan was asked to stop early.
+    """
+    tree: FileSystemTree
+    stats: ScanStats
+    _root: str
+    _results: queue.Queue
+    _folders: Dict[str, FileSystemTree]
+    _start: float
+    _done: bool
+    _stopped: bool
+
+    def __init__(self, path: str, workers: int = DEFAULT_WORKERS) -> None:
+        """Start scanning the file or folder at <path> on <workers> threads.
+
+        Precondition: <path> is a valid path for this computer, and
+        workers >= 1.
+        """
+        self.stats = ScanStats(workers)
+        self._root = path
+        self._results = queue.Queue()
+        self._folders = {}
+        self._start = time.perf_counter()
+        self._stopped = False
+
+        if not os.path.isdir(path):
+            self.tree = _make_node(os.path.basename(path), [],
+                                   os.path.getsize(path))
+            self.stats.files = 1
+            self._done = True
+        else:
+            self.tree = _make_node(os.path.basename(path), [])
+            self.stats.folders = 1
+            self._folders[path] = self.tree
+            self._done = False
+            thread = threading.Thread(target=self._run, args=(workers,),
+                                      daemon=True)
+            thread.start()
+
+    def is_done(self) -> bool:
+        """Return True iff the whole scan has been added to the tree.
+        """
+        return self._done
+
+    def stop(self) -> None:
+        """Ask the background threads to stop reading new folders.
+        """
+        self._stopped = True
+
+    def poll(self) -> bool:
+        """Add every folder listing read since the last call to the tree,
+        and return True iff the tree changed.
+        """
+        changed = False
+        while not self._done:
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if result is None:
+                self._done = True
+                self.stats.seconds = time.perf_counter() - self._start
+            else:
+                self._merge(*result)
+                changed = True
+        return changed
+
+    def progress_text(self) -> str:
+        """Return a short description of the progress of this scan.
+        """
+        if self._done:
+            return 'Scanned {}'.format(self.stats)
+        self.stats.seconds = time.perf_counter() - self._start
+        return 'Scanning... {} files, {} folders ({:.0f} files/sec)'.format(
+            self.stats.files, self.stats.folders,
+            self.stats.files_per_second())
+
+    def _run(self, workers: int) -> None:
+        """Read every folder under the root, putting each listing in the
+        results queue, followed by None.
+        """
+        def read(path: str) -> Tuple[None, List[str]]:
+            if self._stopped:
+                return None, []
+            entries = _list_folder(path)
+            self._results.put((path, entries))
+            return None, _subfolders(entries)
+
+        # The listings are passed on through the queue, so the mapping
+        # returned by the walk only holds None for each folder.
+        _walk_folders(self._root, workers, read)
+        self._results.put(None)
+
+    def _merge(self, path: str, entries: List[Entry]) -> None:
+        """Add the <entries> of the folder at <path> to the tree, and add
+        the sizes of its files to the folder and its ancestors.
+
+        Precondition: the folder's parent folder has already been merged.
+        """
+        folder = self._folders.pop(path)
+        size = 0
+        for name, is_folder, entry_size in entries:
+            if is_folder:
+                child = _make_node(name, [])
+                self._folders[os.path.join(path, name)] = child
+                self.stats.folders += 1
+            else:
+                child = _make_node(name, [], entry_size)
+                size += entry_size
+                self.stats.files += 1
+            folder._add_subtree(child)
+        folder._add_size(size)
+
+
+def _make_node(name: str, subtrees: List[TMTree],
+               data_size: int = 0) -> FileSystemTree:
+    """Return a new FileSystemTree with the given <name>, <subtrees> and
+    <data_size>, without reading anything from the disk.
+    """
+    node = FileSystemTree.__new__(FileSystemTree)
+    TMTree.__init__(node, name, subtrees, data_size)
+    return node
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'os', 'queue', 'sys', 'threading', 'time',
+            'array', 'concurrent.futures', 'tm_trees', '__future__'
+        ],
+        'allowed-io': ['save_snapshot', 'load_snapshot']
+    })
@@ -0,0 +1,186 @@
+"""Alternative treemap layout engines
+
+=== Module Description ===
+This module contains a function that measures how square the rectangles of
+a treemap are, and a layout engine that computes the same slice-and-dice
+rectangles as TMTree.update_rectangles, using NumPy to lay out all of the
+trees at the same depth at once.
+
+TMTree.update_rectangles lays out the subtrees of each tree one at a time in
+Python, which is slow for trees with millions of leaves. Here, the tree is
+walked one level at a time instead. For each level, the sizes of all of the
+subtrees on the next level are put in one array, and the widths (or heights)
+and offsets of every sibling group are computed with a few array operations,
+using cumulative sums in place of the running x (or y) coordinate.
+
+The engine only implements the SLICE_AND_DICE algorithm; trees that use
+another algorithm are laid out with TMTree.update_rectangles instead, as are
+compact trees, which lay themselves out on their own arrays.
+
+NumPy is only needed to use this engine; the rest of the visualiser works
+without it.
+"""
+from __future__ import annotations
+from typing import List, Tuple
+from tm_trees import TMTree, SLICE_AND_DICE
+from compact_tree import CompactNode
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The names of the layout engines that can be used by the visualiser.
+PYTHON_ENGINE = 'python'
+NUMPY_ENGINE = 'numpy'
+
+
+def numpy_update_rectangles(tree: TMTree,
+                            rect: Tuple[int, int, int, int]) -> None:
+    """Update the rectangles in <tree> and its descendants to fill <rect>,
+    giving exactly the same rectangles as tree.update_rectangles(rect).
+
+    Raise ImportError if NumPy is not installed.
+    """
+    if np is None:
+        raise ImportError('the numpy layout engine requires NumPy')
+    if isinstance(tree, CompactNode) or _get_layout(tree) != SLICE_AND_DICE:
+        tree.update_rectangles(rect)
+        return
+
+    tree._touch()
+    tree._dirty = False
+    tree._hit_index = None
+    tree._culled = False
+    if tree.data_size == 0:
+        return
+    tree.rect = tuple(rect)
+
+    level = []
+    if tree._subtrees != [] and not _is_culled(tree, rect):
+        level.append(tree)
+    while level != []:
+        rects = np.array([parent.rect for parent in level], dtype=np.int64)
+        level = _layout_level(level, rects)
+
+
+def _layout_level(level: List[TMTree], rects: np.ndarray) -> List[TMTree]:
+    """Lay out the subtrees of every tree in <level>, whose rectangles are
+    the rows of <rects>, and return the subtrees that need their own
+    subtrees laid out next.
+
+    Precondition: every tree in <level> has subtrees and a non-zero
+    data_size.
+    """
+    children = []
+    counts = []
+    for parent in level:
+        children.extend(parent._subtrees)
+        counts.append(len(parent._subtrees))
+    counts = np.array(counts, dtype=np.int64)
+    totals = np.array([parent.data_size for parent in level],
+                      dtype=np.float64)
+    sizes = np.array([child.data_size for child in children],
+                     dtype=np.float64)
+
+    # group[i] is the index in <level> of the parent of children[i], and
+    # first and last are the indexes of the first and last child of each
+    # parent.
+    group = np.repeat(np.arange(len(level)), counts)
+    last = np.cumsum(counts) - 1
+    first = last - counts + 1
+
+    x, y, width, height = rects.T
+    wide = width > height
+    length = np.where(wide, width, height)
+
+    # The same arithmetic as _wide_update and _tall_update: every subtree
+    # but the last is truncated, and the last is rounded up.
+    proportion = sizes / totals[group]
+    extent = proportion * length[group]
+    is_last = np.zeros(len(children), dtype=bool)
+    is_last[last] = True
+    extent = np.where(is_last, np.ceil(extent),
+                      np.trunc(extent)).astype(np.int64)
+
+    # The offset of each subtree from its parent's corner is the sum of the
+    # extents of its earlier siblings.
+    ends = np.cumsum(extent)
+    offset = ends - extent
+    offset -= offset[first][group]
+
+    child_wide = wide[group]
+    child_x = x[group] + np.where(child_wide, offset, 0)
+    child_y = y[group] + np.where(child_wide, 0, offset)
+    child_width = np.where(child_wide, extent, width[group])
+    child_height = np.where(child_wide, height[group], extent)
+    child_rects = zip(child_x.tolist(), child_y.tolist(),
+                      child_width.tolist(), child_height.tolist())
+
+    next_level = []
+    for child, child_rect in zip(children, child_rects):
+        child.rect = child_rect
+        child._dirty = False
+        child._hit_index = None
+        child._culled = False
+        if child.data_size == 0 or child._subtrees == []:
+            pass
+        elif _is_culled(child, child_rect):
+            pass
+        elif child._layout not in (None, SLICE_AND_DICE):
+            child.update_rectangles(child_rect)
+        else:
+            next_level.append(child)
+    return next_level
+
+
+def _is_culled(tree: TMTree, rect: Tuple[int, int, int, int]) -> bool:
+    """Return whether <rect> is too small for the subtrees of <tree> to be
+    laid out, as in TMTree.update_rectangles, and record it in <tree>.
+    """
+    tree._culled = rect[2] < TMTree._min_size or rect[3] < TMTree._min_size
+    if tree._culled:
+        tree._clear_subtree_rects()
+    return tree._culled
+
+
+def _get_layout(tree: TMTree) -> str:
+    """Return the treemap algorithm that update_rectangles uses for <tree>.
+    """
+    while tree is not None:
+        if tree._layout is not None:
+            return tree._layout
+        tree = tree._parent_tree
+    return SLICE_AND_DICE
+
+
+def aspect_ratios(tree: TMTree) -> Tuple[float, float]:
+    """Return the mean and the worst aspect ratio (longer side over shorter
+    side) of the rectangles of the leaves of <tree> that are displayed and
+    have a non-zero area, or (0.0, 0.0) if there are none.
+
+    A ratio of 1 is a square; the closer to 1 the ratios are, the easier the
+    rectangles are to see and compare.
+    """
+    count = 0
+    total = 0.0
+    worst = 0.0
+    for (_, _, width, height), _ in tree.get_rectangles():
+        if width > 0 and height > 0:
+            ratio = max(width, height) / min(width, height)
+            count += 1
+            total += ratio
+            worst = max(worst, ratio)
+    if count == 0:
+        return 0.0, 0.0
+    return total / count, worst
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'numpy', 'tm_trees', 'compact_tree',
+            '__future__'
+        ]
+    })
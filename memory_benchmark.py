@@ -0,0 +1,122 @@
+"""Memory benchmark for the treemap trees
+
+=== Module Description ===
+This module measures how many bytes each node of a large synthetic tree
+takes, for:
+    - the tree classes as they were before they had __slots__, i.e. with a
+      dictionary per instance,
+    - the slotted tree classes,
+    - a CompactTree holding the same tree.
+
+The unslotted classes are rebuilt from the slotted ones at run time, with the
+same methods but without __slots__, so the comparison always matches the
+current code.
+
+Run this module directly, optionally with the number of leaves to create:
+    python memory_benchmark.py 1000000
+"""
+from __future__ import annotations
+import sys
+import tracemalloc
+from typing import Callable, List
+from tm_trees import TMTree, FileSystemTree
+from compact_tree import compact_tree
+
+# The default number of leaves in the synthetic tree.
+DEFAULT_LEAVES = 1000000
+
+# The number of subtrees of each folder in the synthetic tree.
+FAN_OUT = 100
+
+
+def unslotted(cls: type, base: type = object) -> type:
+    """Return a copy of the tree class <cls> without __slots__, whose
+    instances keep their attributes in a dictionary instead, with <base> as
+    its base class.
+    """
+    slots = getattr(cls, '__slots__', ())
+    namespace = {}
+    for name, value in vars(cls).items():
+        if name not in slots and name not in ('__slots__', '__dict__',
+                                              '__weakref__'):
+            namespace[name] = value
+    return type(cls.__name__, (base,), namespace)
+
+
+def build_tree(cls: type, leaves: int) -> TMTree:
+    """Return a synthetic tree of <cls> nodes with <leaves> leaves, grouped
+    in folders of FAN_OUT subtrees each, with as many levels of folders as
+    needed.
+    """
+    level = [_make_node(cls, 'file{}.txt'.format(i), [], i % 1000 + 1)
+             for i in range(leaves)]
+    depth = 0
+    while len(level) > 1:
+        depth += 1
+        level = [_make_node(cls, 'folder{}-{}'.format(depth, i),
+                            level[i:i + FAN_OUT])
+                 for i in range(0, len(level), FAN_OUT)]
+    return level[0]
+
+
+def _make_node(cls: type, name: str, subtrees: List[TMTree],
+               data_size: int = 0) -> TMTree:
+    """Return a new <cls> with the given <name>, <subtrees> and <data_size>.
+    """
+    node = cls.__new__(cls)
+    TMTree.__init__(node, name, subtrees, data_size)
+    return node
+
+
+def count_nodes(tree: TMTree) -> int:
+    """Return the number of nodes in <tree>.
+    """
+    count = 0
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        count += 1
+        stack.extend(tree._subtrees)
+    return count
+
+
+def measure(build: Callable[[], object]) -> int:
+    """Return the number of bytes still allocated by <build> once it has
+    returned, while its result is alive.
+    """
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def run_benchmark(leaves: int = DEFAULT_LEAVES) -> None:
+    """Print the number of bytes per node of a synthetic tree with <leaves>
+    leaves, for each way of storing it.
+    """
+    plain_tree = unslotted(TMTree)
+    plain_file = unslotted(FileSystemTree, plain_tree)
+
+    tree = build_tree(FileSystemTree, leaves)
+    nodes = count_nodes(tree)
+    del tree
+    print('Synthetic tree: {} leaves, {} nodes'.format(leaves, nodes))
+
+    results = [
+        ('without __slots__', measure(lambda: build_tree(plain_file, leaves))),
+        ('with __slots__', measure(lambda: build_tree(FileSystemTree,
+                                                      leaves)))
+    ]
+    tree = build_tree(FileSystemTree, leaves)
+    results.append(('CompactTree', measure(lambda: compact_tree(tree))))
+    for label, size in results:
+        print('{:>20}: {:8.1f} bytes per node'.format(label, size / nodes))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run_benchmark(int(sys.argv[1]))
+    else:
+        run_benchmark()
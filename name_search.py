@@ -0,0 +1,202 @@
+"""Name search for the treemap trees
+
+=== Module Description ===
+This module contains NameIndex, which finds the trees whose names contain a
+query, or start with it, without walking the tree.
+
+The names a tree can be found by are given by its get_search_names method:
+the name of a file or folder for a FileSystemTree, and the title and authors
+of a paper or the name of a category for a PaperTree.
+
+A NameIndex is built once for a whole tree. Every name is lowered and put in
+one long string, each name preceded by SEPARATOR, with an array of the
+positions where the names start. A query is then a single str.find over that
+string, which runs at the speed of a memory scan rather than a Python loop,
+and a binary search on the array turns each match back into its tree. Only
+the matches actually returned cost any Python work, so a query over millions
+of trees takes tens of milliseconds.
+
+The names are also kept in sorted order, so the names that start with a
+query are found with two binary searches, in microseconds.
+
+Moving a tree does not change any name, so an index stays valid as trees are
+moved. Trees added afterwards (e.g. by a background scan) are only found
+once the index is built again.
+"""
+from __future__ import annotations
+from array import array
+from bisect import bisect_right
+from typing import Callable, Iterator, List, Optional, Tuple
+from tm_trees import TMTree
+from compact_tree import CompactNode
+
+# The character put before each name in the text of an index. It cannot
+# appear in a file name.
+SEPARATOR = '\0'
+
+# The default largest number of trees returned by NameIndex.search.
+SEARCH_LIMIT = 1000
+
+
+class NameIndex:
+    """An index of the names of every tree in a tree.
+
+    === Private Attributes ===
+    _text:
+        The lowered names of the trees, each preceded by SEPARATOR, in
+        preorder.
+    _starts:
+        The position in _text of the SEPARATOR before each name, followed by
+        the length of _text.
+    _owners:
+        The number of the tree each name belongs to.
+    _sorted:
+        The numbers of the names (their indexes in _owners), in order of
+        their lowered text.
+    _get_tree:
+        A function returning the tree with a given number.
+    """
+    _text: str
+    _starts: array
+    _owners: array
+    _sorted: array
+    _get_tree: Callable[[int], TMTree]
+
+    def __init__(self, tree: TMTree) -> None:
+        """Index the names of <tree> and all of its descendants.
+
+        A lazily listed tree is indexed as far as it has been listed.
+        """
+        if isinstance(tree, CompactNode):
+            entries = _compact_entries(tree)
+            self._get_tree = tree._store.node
+        else:
+            trees = []
+            entries = _tree_entries(tree, trees)
+            self._get_tree = trees.__getitem__
+
+        names = []
+        self._starts = array('q')
+        self._owners = array('i')
+        position = 0
+        for number, tree_names in entries:
+            for name in tree_names:
+                name = SEPARATOR + name.lower()
+                names.append(name)
+                self._starts.append(position)
+                self._owners.append(number)
+                position += len(name)
+        self._starts.append(position)
+        self._text = ''.join(names)
+        self._sorted = array('i', sorted(range(len(names)),
+                                         key=names.__getitem__))
+
+    def __len__(self) -> int:
+        """Return the number of names in this index.
+        """
+        return len(self._owners)
+
+    def search(self, query: str, prefix: bool = False,
+               limit: Optional[int] = SEARCH_LIMIT) -> List[TMTree]:
+        """Return the trees with a name that contains <query>, ignoring
+        case, in preorder. If <prefix>, only return the trees with a name
+        that starts with <query>, in order of that name.
+
+        Return at most <limit> trees, or all of them if <limit> is None.
+        Return no trees if <query> is empty.
+        """
+        query = query.lower().replace(SEPARATOR, '')
+        if query == '':
+            return []
+        if prefix:
+            return self._search_prefix(query, limit)
+        text = self._text
+        starts = self._starts
+        found = []
+        last = -1
+        position = text.find(query)
+        while position != -1 and (limit is None or len(found) < limit):
+            entry = bisect_right(starts, position) - 1
+            number = self._owners[entry]
+            if number != last:
+                found.append(self._get_tree(number))
+                last = number
+            # Skip the rest of this name, so each name is found at most once.
+            position = text.find(query, starts[entry + 1])
+        return found
+
+    def _search_prefix(self, query: str,
+                       limit: Optional[int]) -> List[TMTree]:
+        """Return the trees with a name that starts with the lowered
+        <query>, as search does.
+        """
+        first = self._find_sorted(query)
+        found = []
+        seen = set()
+        i = first
+        while i < len(self._sorted) and (limit is None or
+                                         len(found) < limit):
+            entry = self._sorted[i]
+            if not self._name(entry).startswith(query):
+                break
+            number = self._owners[entry]
+            if number not in seen:
+                found.append(self._get_tree(number))
+                seen.add(number)
+            i += 1
+        return found
+
+    def _find_sorted(self, query: str) -> int:
+        """Return the position in _sorted of the first name that is not
+        smaller than <query>.
+        """
+        low = 0
+        high = len(self._sorted)
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(self._sorted[middle]) < query:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _name(self, entry: int) -> str:
+        """Return the lowered text of name <entry>.
+        """
+        return self._text[self._starts[entry] + 1:self._starts[entry + 1]]
+
+
+def _tree_entries(tree: TMTree,
+                  trees: List[TMTree]) -> Iterator[Tuple[int, List[str]]]:
+    """Yield the number and the search names of <tree> and each of its
+    descendants, in preorder, appending each of them to <trees> so that its
+    number is its index there.
+    """
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        trees.append(tree)
+        yield len(trees) - 1, tree.get_search_names()
+        stack.extend(reversed(tree._subtrees))
+
+
+def _compact_entries(tree: CompactNode) -> Iterator[Tuple[int, List[str]]]:
+    """Yield the node number and name of the node of <tree> and each of its
+    descendants in its store, in preorder.
+    """
+    store = tree._store
+    stack = [tree._index]
+    while stack:
+        index = stack.pop()
+        yield index, [store._name(index)]
+        stack.extend(reversed(store._children(index)))
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'array', 'bisect', 'tm_trees',
+            'compact_tree', '__future__'
+        ]
+    })
@@ -0,0 +1,346 @@
+"""Columnar paper store for very large paper datasets
+
+=== Module Description ===
+This module contains a binary, column-oriented format for paper datasets,
+and a PaperStore that reads it through a memory map.
+
+papers.load_records keeps every paper as a tuple of Python strings, which
+does not scale to tens of millions of papers. Here, convert_papers turns a
+data file (in the same CSV format as papers.DATA_FILE) into a store file
+with one column per field:
+    - year and citations as arrays of machine integers,
+    - the category of each paper as an index into a table of the distinct
+      categories, which are far fewer than the papers,
+    - author, title and url as a blob of UTF-8 text with an array of
+      offsets into it.
+
+A PaperStore maps the file into memory and reads the numeric columns as
+NumPy arrays directly from the map, so filtering and adding up citations
+over all of the papers never creates a Python object per paper. Strings are
+only decoded for the papers that actually end up as leaves of a PaperTree.
+
+NumPy is needed to read a store, but not to write one.
+"""
+from __future__ import annotations
+import csv
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+from array import array
+from typing import BinaryIO, Dict, Iterator, List, Optional
+from papers import PaperTree, Record, build_subtrees
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The first bytes of every store file.
+STORE_MAGIC = b'TMPAPER1'
+
+# The string columns of a store, in file order.
+STRING_COLUMNS = ['author', 'title', 'url']
+
+# The size of the header: magic, byte order, number of papers and number of
+# distinct categories.
+_HEADER_SIZE = 32
+
+
+def convert_papers(data_file: str, store_file: str) -> int:
+    """Convert the paper data file <data_file> to a store file at
+    <store_file>, and return the number of papers.
+
+    The data file is read one row at a time. The strings of each column are
+    written to a temporary file as they are read, so only the numeric
+    columns and the distinct categories are kept in memory. The store file
+    is replaced atomically.
+
+    Precondition: the Year of every paper is an integer.
+    """
+    years = array('i')
+    citations = array('q')
+    category_ids = array('i')
+    categories = {}
+    offsets = {column: array('q', [0]) for column in STRING_COLUMNS}
+
+    with tempfile.TemporaryDirectory() as folder:
+        blobs = {column: open(os.path.join(folder, column), 'w+b')
+                 for column in STRING_COLUMNS}
+        try:
+            with open(data_file, newline='') as csvfile:
+                for row in csv.DictReader(csvfile):
+                    years.append(int(row['Year']))
+                    citations.append(int(row['Citations']))
+                    category_ids.append(categories.setdefault(
+                        row['Category'], len(categories)))
+                    for column, field in zip(STRING_COLUMNS,
+                                             ['Author', 'Title', 'Url']):
+                        text = row[field].encode('utf-8')
+                        blobs[column].write(text)
+                        offsets[column].append(offsets[column][-1] +
+                                               len(text))
+
+            temp = store_file + '.tmp'
+            with open(temp, 'wb') as store:
+                store.write(STORE_MAGIC)
+                store.write(sys.byteorder.encode('ascii').ljust(8))
+                store.write(len(years).to_bytes(8, 'little'))
+                store.write(len(categories).to_bytes(8, 'little'))
+                for column in [years, citations, category_ids]:
+                    _write_column(store, column)
+                for column in STRING_COLUMNS:
+                    _write_column(store, offsets[column])
+                    blobs[column].seek(0)
+                    shutil.copyfileobj(blobs[column], store)
+                    _pad(store)
+                _write_strings(store, list(categories))
+            os.replace(temp, store_file)
+        finally:
+            for blob in blobs.values():
+                blob.close()
+    return len(years)
+
+
+def _write_column(store: BinaryIO, column: array) -> None:
+    """Write the numbers in <column> to <store>, padded to a multiple of 8
+    bytes.
+    """
+    column.tofile(store)
+    _pad(store)
+
+
+def _write_strings(store: BinaryIO, strings: List[str]) -> None:
+    """Write <strings> to <store> as an array of offsets followed by a blob.
+    """
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = array('q', [0])
+    for text in encoded:
+        offsets.append(offsets[-1] + len(text))
+    _write_column(store, offsets)
+    store.write(b''.join(encoded))
+    _pad(store)
+
+
+def _pad(store: BinaryIO) -> None:
+    """Write zero bytes to <store> until its size is a multiple of 8, so
+    that the next column is aligned.
+    """
+    store.write(bytes(-store.tell() % 8))
+
+
+class PaperStore:
+    """A paper store file, opened through a memory map.
+
+    === Public Attributes ===
+    years:
+        The year of each paper.
+    citations:
+        The number of citations of each paper.
+    category_ids:
+        The index in categories of the category of each paper.
+    categories:
+        The distinct categories, in the order they first appear.
+
+    === Private Attributes ===
+    _file:
+        The open store file.
+    _map:
+        The memory map of _file.
+    _strings:
+        The offsets array and the position of the blob of each string
+        column, by column name.
+    """
+    years: np.ndarray
+    citations: np.ndarray
+    category_ids: np.ndarray
+    categories: List[str]
+    _file: BinaryIO
+    _map: mmap.mmap
+    _strings: Dict[str, tuple]
+
+    def __init__(self, store_file: str) -> None:
+        """Open the store file at <store_file>.
+
+        Raise ImportError if NumPy is not installed, and ValueError if the
+        file is not a store file written on a machine with the same byte
+        order, or is damaged.
+        """
+        if np is None:
+            raise ImportError('reading a paper store requires NumPy')
+        self._file = open(store_file, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError('{} is not a paper store'.format(store_file))
+        header = self._map[:_HEADER_SIZE]
+        if len(header) < _HEADER_SIZE or header[:8] != STORE_MAGIC or \
+                header[8:16].rstrip() != sys.byteorder.encode('ascii'):
+            self.close()
+            raise ValueError('{} is not a paper store for this machine'
+                             .format(store_file))
+        count = int.from_bytes(header[16:24], 'little')
+        category_count = int.from_bytes(header[24:32], 'little')
+
+        self._strings = {}
+        try:
+            position = _HEADER_SIZE
+            self.years, position = self._column(np.int32, count, position)
+            self.citations, position = self._column(np.int64, count,
+                                                    position)
+            self.category_ids, position = self._column(np.int32, count,
+                                                       position)
+            for column in STRING_COLUMNS:
+                offsets, position = self._column(np.int64, count + 1,
+                                                 position)
+                self._strings[column] = (offsets, position)
+                position += _padded(int(offsets[-1]))
+            offsets, position = self._column(np.int64, category_count + 1,
+                                             position)
+            self.categories = [self._decode(offsets, position, i)
+                               for i in range(category_count)]
+        except (ValueError, IndexError):
+            # A column runs past the end of the file, or a string is not
+            # valid UTF-8.
+            self.close()
+            raise ValueError('{} is a damaged paper store'.format(store_file))
+
+    def _column(self, dtype: type, count: int, position: int) -> tuple:
+        """Return the array of <count> numbers of type <dtype> that starts at
+        <position> in the map, and the position of the next column.
+        """
+        column = np.frombuffer(self._map, dtype=dtype, count=count,
+                               offset=position)
+        return column, position + _padded(column.nbytes)
+
+    def _decode(self, offsets: np.ndarray, blob: int, index: int) -> str:
+        """Return string <index> of the blob at position <blob> in the map,
+        with the given <offsets>.
+        """
+        start = blob + int(offsets[index])
+        end = blob + int(offsets[index + 1])
+        return self._map[start:end].decode('utf-8')
+
+    def __len__(self) -> int:
+        """Return the number of papers in this store.
+        """
+        return len(self.years)
+
+    def close(self) -> None:
+        """Close this store.
+
+        The arrays of this store are views of its memory map, so the map
+        cannot be unmapped while the caller still holds one of them (or a
+        slice of one). In that case, it is unmapped when the last of them
+        is released instead.
+        """
+        self.years = self.citations = self.category_ids = None
+        self._strings = {}
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def get_string(self, column: str, index: int) -> str:
+        """Return the value of the string <column> ('author', 'title' or
+        'url') for paper <index>.
+        """
+        offsets, blob = self._strings[column]
+        return self._decode(offsets, blob, index)
+
+    def select(self, min_year: Optional[int] = None,
+               max_year: Optional[int] = None,
+               min_citations: int = 0) -> np.ndarray:
+        """Return the indexes of the papers published from <min_year> to
+        <max_year> (inclusive, where None means no limit) with at least
+        <min_citations> citations, in file order.
+        """
+        keep = self.citations >= min_citations
+        if min_year is not None:
+            keep &= self.years >= min_year
+        if max_year is not None:
+            keep &= self.years <= max_year
+        return np.flatnonzero(keep)
+
+    def records(self, rows: Optional[np.ndarray] = None) -> Iterator[Record]:
+        """Yield the papers with the indexes in <rows> (all of them if <rows>
+        is None) as records, like papers.load_records.
+        """
+        if rows is None:
+            rows = range(len(self))
+        for index in rows:
+            index = int(index)
+            yield (self.get_string('author', index),
+                   self.get_string('title', index),
+                   str(self.years[index]),
+                   self.categories[self.category_ids[index]],
+                   self.get_string('url', index),
+                   int(self.citations[index]))
+
+    def paper_tree(self, name: str, by_year: bool = True,
+                   rows: Optional[np.ndarray] = None) -> PaperTree:
+        """Return a PaperTree called <name> with a leaf for each paper with
+        an index in <rows> (every paper if <rows> is None), arranged as in
+        PaperTree(name, [], by_year=<by_year>, all_papers=True).
+        """
+        return PaperTree(name, build_subtrees(self.records(rows), by_year))
+
+    def category_tree(self, name: str, by_year: bool = True,
+                      rows: Optional[np.ndarray] = None) -> PaperTree:
+        """Return a PaperTree called <name> with a leaf for each category
+        (within each year, if <by_year>) of the papers with an index in
+        <rows>, or of all papers if <rows> is None. The size of each leaf is
+        the total number of citations of its papers.
+
+        The totals are computed with NumPy over the whole selection, so this
+        shows the shape of a dataset too large to have a leaf per paper.
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        category_ids = self.category_ids[rows].astype(np.int64)
+        citations = self.citations[rows]
+        years = np.zeros(len(rows), dtype=np.int64)
+        if by_year:
+            years = self.years[rows].astype(np.int64)
+        keys = years * len(self.categories) + category_ids
+        unique_keys, first, inverse = np.unique(keys, return_index=True,
+                                                return_inverse=True)
+        totals = np.bincount(inverse, weights=citations,
+                             minlength=len(unique_keys))
+
+        # Keep the groups in the order their first paper appears.
+        groups = {}
+        for i in np.argsort(first, kind='stable').tolist():
+            key = int(unique_keys[i])
+            year, category = divmod(key, len(self.categories))
+            leaf = PaperTree(self.categories[category], [],
+                             citations=int(totals[i]))
+            if by_year:
+                groups.setdefault(year, []).append(leaf)
+            else:
+                groups.setdefault(None, []).append(leaf)
+        if not by_year:
+            return PaperTree(name, groups.get(None, []))
+        return PaperTree(name, [PaperTree(str(year), leaves)
+                                for year, leaves in groups.items()])
+
+
+def _padded(size: int) -> int:
+    """Return <size> rounded up to a multiple of 8.
+    """
+    return size + -size % 8
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'csv', 'mmap', 'os', 'shutil', 'sys',
+            'tempfile', 'array', 'numpy', 'papers', '__future__'
+        ],
+        'allowed-io': ['convert_papers', 'PaperStore.__init__']
+    })
@@ -22,12 +22,44 @@ and we can then run it through our treemap visualisation tool to get a nice
 interactive graphical representation of this data.
 """
 import csv
-from typing import List, Dict
-from tm_trees import TMTree
+import os
+import sys
+import time
+from array import array
+from itertools import islice
+from typing import Callable, Iterable, List, Dict, Optional, Tuple, Union
+from tm_trees import TMTree, build_tree
 
 # Filename for the dataset
 DATA_FILE = 'cs1_papers.csv'
 
+# Filename for the on-disk cache of the parsed dataset, or None to only keep
+# it in memory. See load_records.
+CACHE_FILE = None
+
+# The first bytes of every cache file.
+CACHE_MAGIC = b'PAPERS02'
+
+# The number of string fields of a Record; the last field is a number.
+_STRING_FIELDS = 5
+
+# A single paper: (author, title, year, category, url, citations).
+Record = Tuple[str, str, str, str, str, int]
+
+# The name used by regroup for a category level that a paper does not have.
+NO_VALUE = '(none)'
+
+# The number of rows read at a time by stream_paper_tree.
+CHUNK_ROWS = 10000
+
+# The name of the leaf that stands for the small papers of a category in a
+# tree built by stream_paper_tree.
+OTHER = 'other'
+
+# The parsed datasets read so far, by filename, each with the modification
+# time (in nanoseconds) and size of the file when it was read.
+_records_cache: Dict[str, Tuple[int, int, List[Record]]] = {}
+
 class PaperTree(TMTree):
     """A tree representation of Computer Science Education research paper data.
 
@@ -61,6 +93,7 @@ class PaperTree(TMTree):
     """
     _authors: str
     _doi: str
+    __slots__ = ('_authors', '_doi')
 
     def __init__(self, name: str, subtrees: List[TMTree], authors: str = '',
                  doi: str = '', citations: int = 0, by_year: bool = True,
@@ -83,18 +116,17 @@ class PaperTree(TMTree):
         self._authors = authors
 
         if all_papers:
-            tree_list = _children(by_year)
-            for t in tree_list:
-                self._subtrees.append(t)
-
-            new_size = 0
-            for subtree in self._subtrees:
+            # build_tree has already set the parents, sizes and expanded
+            # state of every tree below the first level, and indexed them by
+            # path, so only the first level needs to be attached to this
+            # tree.
+            subtrees = _children(by_year)
+            self._take_path_index(subtrees)
+            for subtree in subtrees:
+                self._subtrees.append(subtree)
                 subtree._parent_tree = self
-                subtree._parent_check()
-                subtree._closed()
-                x = subtree.update_data_sizes()
-                new_size += x
-            self.data_size = new_size
+            self.data_size = sum(subtree.data_size
+                                 for subtree in self._subtrees)
         else:
             pass
 
@@ -108,6 +140,14 @@ class PaperTree(TMTree):
         else:
             return ': '
 
+    def get_search_names(self) -> List[str]:
+        """Return the title and authors of this paper, or the name of this
+        category.
+        """
+        if self._authors != '':
+            return [self._name, self._authors]
+        return [self._name]
+
     def get_suffix(self) -> str:
         """Return the string used at the end of the string representation of
         a path from the tree root to this tree.
@@ -142,82 +182,398 @@ def _children(by_year: bool) -> List[PaperTree]:
     """Return a list of first level subtrees from the data file.
     First level subtrees will be years if by_year is True, otherwise
     they will be categories.
+
+    The records of the data file come from load_records, so the file is
+    only parsed again if it has changed.
+    """
+    return build_subtrees(load_records(DATA_FILE, CACHE_FILE), by_year)
+
+
+def build_subtrees(records: Iterable[Record],
+                   by_year: bool) -> List[PaperTree]:
+    """Return the first level subtrees for the papers in <records>, as
+    _children does for the papers in the data file.
+
+    The path of each paper is its year (if <by_year>) followed by its
+    categories.
+    """
+    paths = []
+    for record in records:
+        path = record[3].split(': ')
+        if by_year:
+            path.insert(0, record[2])
+        paths.append((path, record))
+    return _build_paths(paths)
+
+
+def regroup(name: str, keys: List[str],
+            records: Optional[List[Record]] = None) -> PaperTree:
+    """Return a PaperTree called <name> for the papers in <records>, grouped
+    by each of <keys> in turn. If <records> is None, use the papers in the
+    data file, which are usually already loaded; see load_records.
+
+    Each key is one of:
+        - 'year': the year of the paper,
+        - 'author': the first author of the paper,
+        - 'category': all of the categories of the paper, one level each,
+        - 'category1', 'category2', ...: a single level of the categories,
+          or NO_VALUE if the paper has fewer levels,
+        - 'citations': the band of the paper's number of citations: '0',
+          '1-9', '10-99', and so on.
+
+    For example, regroup('CS1', ['year', 'category']) is arranged like
+    PaperTree('CS1', [], by_year=True, all_papers=True).
+
+    Raise ValueError if a key is not one of these.
+    """
+    if records is None:
+        records = load_records(DATA_FILE, CACHE_FILE)
+    getters = [_key_getter(key) for key in keys]
+    paths = []
+    for record in records:
+        path = []
+        for getter in getters:
+            path.extend(getter(record))
+        paths.append((path, record))
+    return PaperTree(name, _build_paths(paths))
+
+
+def _key_getter(key: str) -> Callable[[Record], List[str]]:
+    """Return a function that returns the names of the levels for <key>,
+    one of the keys accepted by regroup, for a paper.
+    """
+    if key == 'year':
+        return lambda record: [record[2]]
+    elif key == 'author':
+        return lambda record: [record[0].split(' and ')[0]]
+    elif key == 'category':
+        return lambda record: record[3].split(': ')
+    elif key == 'citations':
+        return lambda record: [_citation_band(record[5])]
+    elif key.startswith('category') and key[8:].isdigit() and \
+            int(key[8:]) >= 1:
+        level = int(key[8:]) - 1
+
+        def category_level(record: Record) -> List[str]:
+            categories = record[3].split(': ')
+            if level < len(categories):
+                return [categories[level]]
+            return [NO_VALUE]
+        return category_level
+    else:
+        raise ValueError('unknown key {!r}'.format(key))
+
+
+def _citation_band(citations: int) -> str:
+    """Return the name of the band for <citations>: '0', '1-9', '10-99',
+    '100-999', and so on.
+    """
+    if citations <= 0:
+        return '0'
+    low = 10 ** (len(str(citations)) - 1)
+    return '{}-{}'.format(low, low * 10 - 1)
+
+
+def _build_paths(paths: Iterable[Tuple[List[str], Record]]
+                 ) -> List[PaperTree]:
+    """Return the first level subtrees of a tree with a leaf for each
+    (path, paper) in <paths>, below the trees named by its path.
+
+    Each path is followed through a trie held in a dictionary, keyed by
+    (node, name), so finding the tree for each part of a path takes
+    constant time. The trees are then built all at once with build_tree.
+    """
+    # Node 0 is a placeholder root, whose subtrees are returned.
+    names = [None]
+    parents = [0]
+    sizes = [0]
+    authors = ['']
+    dois = ['']
+    # The first subtree of each node with each name.
+    trie = {}
+
+    for cat_paper, (author, title, _, _, url, citations) in paths:
+        parent = 0
+        for name in cat_paper:
+            child = trie.get((parent, name))
+            if child is None:
+                child = len(names)
+                trie[(parent, name)] = child
+                names.append(name)
+                parents.append(parent)
+                sizes.append(0)
+                authors.append('')
+                dois.append('')
+            parent = child
+        # A paper can be found by its title, like a category, if no
+        # earlier subtree of its category has the same name.
+        trie.setdefault((parent, title), len(names))
+        names.append(title)
+        parents.append(parent)
+        sizes.append(citations)
+        authors.append(author)
+        dois.append(url)
+
+    root = build_tree(PaperTree, names, parents, sizes,
+                      {'_authors': authors, '_doi': dois})
+    return root._subtrees
+
+
+class IngestStats:
+    """Statistics about streaming a paper data file.
+
+    === Public Attributes ===
+    rows:
+        The number of papers read so far.
+    kept:
+        The number of papers kept as leaves.
+    merged:
+        The number of papers merged into OTHER leaves.
+    seconds:
+        The wall-clock time taken so far, in seconds.
+    """
+    rows: int
+    kept: int
+    merged: int
+    seconds: float
+
+    def __init__(self) -> None:
+        """Initialize empty statistics.
+        """
+        self.rows = 0
+        self.kept = 0
+        self.merged = 0
+        self.seconds = 0.0
+
+    def rows_per_second(self) -> float:
+        """Return the number of papers read per second.
+        """
+        if self.seconds <= 0:
+            return float(self.rows)
+        return self.rows / self.seconds
+
+    def __str__(self) -> str:
+        """Return a one-line summary of the ingestion.
+        """
+        return '{} papers in {:.2f}s ({:.0f} rows/sec), {} kept, {} merged ' \
+               'into "{}"'.format(self.rows, self.seconds,
+                                  self.rows_per_second(), self.kept,
+                                  self.merged, OTHER)
+
+
+def stream_paper_tree(name: str, filename: str = DATA_FILE,
+                      by_year: bool = True, min_citations: int = 0,
+                      chunk_rows: int = CHUNK_ROWS,
+                      progress: Optional[Callable[[IngestStats], None]] = None
+                      ) -> Tuple[PaperTree, IngestStats]:
+    """Return a PaperTree called <name> for the papers in the data file
+    <filename>, together with statistics about reading it.
+
+    The file is read <chunk_rows> rows at a time, and only the papers with
+    at least <min_citations> citations are kept as leaves. The other papers
+    of each category (within each year, if <by_year>) are only added up,
+    into a single leaf called OTHER whose size is their total number of
+    citations, so memory use depends on the number of papers kept and of
+    categories rather than the size of the file. With <min_citations> 0,
+    the tree is the same as PaperTree(name, [], by_year=<by_year>,
+    all_papers=True) for the same file.
+
+    If <progress> is not None, it is called with the statistics so far after
+    each chunk.
+    """
+    stats = IngestStats()
+    start = time.perf_counter()
+    # The kept papers, and the (year, category) key of each OTHER leaf at
+    # the position of its first paper, so that the categories keep their
+    # order in the file.
+    entries: List[Union[Record, Tuple[str, str]]] = []
+    others: Dict[Tuple[str, str], int] = {}
+
+    with open(filename, newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        author, title, year, category, url, citations = [
+            header.index(field) for field in
+            ['Author', 'Title', 'Year', 'Category', 'Url', 'Citations']]
+        while True:
+            chunk = list(islice(reader, chunk_rows))
+            if chunk == []:
+                break
+            for row in chunk:
+                size = int(row[citations])
+                if size >= min_citations:
+                    entries.append((row[author], row[title], row[year],
+                                    row[category], row[url], size))
+                    stats.kept += 1
+                else:
+                    key = (row[year] if by_year else '', row[category])
+                    if key not in others:
+                        others[key] = 0
+                        entries.append(key)
+                    others[key] += size
+                    stats.merged += 1
+            stats.rows += len(chunk)
+            stats.seconds = time.perf_counter() - start
+            if progress is not None:
+                progress(stats)
+
+    def records() -> Iterable[Record]:
+        """Yield the kept papers, and an OTHER paper for each category.
+        """
+        for entry in entries:
+            if len(entry) == 2:
+                yield '', OTHER, entry[0], entry[1], '', others[entry]
+            else:
+                yield entry
+
+    tree = PaperTree(name, build_subtrees(records(), by_year))
+    stats.seconds = time.perf_counter() - start
+    return tree, stats
+
+
+def load_records(filename: str,
+                 cache_file: Optional[str] = None) -> List[Record]:
+    """Return the papers in the data file <filename>, in file order.
+
+    The parsed records are kept in memory and returned again, without
+    reading the file, for as long as its modification time and size stay
+    the same. If <cache_file> is not None, it is the path of an on-disk
+    cache of the records, which is used instead of parsing the file when it
+    was saved for the same version of it, and rewritten otherwise.
+
+    The returned list is shared, so it must not be modified by the caller.
     """
-    top_list = []
-    years = []
+    info = os.stat(filename)
+    key = (info.st_mtime_ns, info.st_size)
+    cached = _records_cache.get(filename)
+    if cached is not None and cached[:2] == key:
+        return cached[2]
+
+    records = None
+    if cache_file is not None:
+        records = _read_cache(cache_file, filename, key)
+    if records is None:
+        records = _parse_records(filename)
+        if cache_file is not None:
+            _write_cache(cache_file, filename, key, records)
+    _records_cache[filename] = (key[0], key[1], records)
+    return records
+
 
-    with open(DATA_FILE, newline='') as csvfile:
+def _parse_records(filename: str) -> List[Record]:
+    """Return the papers in the data file <filename>, in file order.
+    """
+    records = []
+    with open(filename, newline='') as csvfile:
         reader = csv.DictReader(csvfile)
         for row in reader:
-            leaf = PaperTree(row['Title'], [], row['Author'], row['Url'],
-                             int(row['Citations']))
-            cat_paper = row['Category'].split(': ')
-            if by_year:
-                cat_paper.insert(0, row['Year'])
-            if cat_paper[0] not in years:
-                leaves = [leaf]
-                #backward_cat = cat_paper[:]
-                #backward_cat.reverse()
-                cat_paper.reverse()
-                i = 0
-                #while i < len(backward_cat):
-                while i < len(cat_paper):
-                    leaves.append(PaperTree(cat_paper[i], [leaves[i]]))
-                    #leaves.append(PaperTree(backward_cat[i], [leaves[i]]))
-                    i += 1
-                top_list.append(leaves[-1])
-                #years.append(leaves[-1]._name)
-                #years.append(cat_paper[0])
-                years.append(cat_paper[-1])
-            else:
-                i = 1
-                find = years.index(cat_paper[0])
-                parent = top_list[find]
-                searching = parent._subtrees
-                names = _names_list(searching)
-                while (i < len(cat_paper)) and (cat_paper[i] in names):
-                    find = names.index(cat_paper[i])
-                    parent = searching[find]
-                    searching = parent._subtrees
-                    names = _names_list(searching)
-                    i += 1
-                if i == len(cat_paper):
-                    searching.append(leaf)
-                    leaf._parent_tree = parent
-                else:
-                    cate = cat_paper[i:]
-                    searching.append(_path(cate, leaf))
-                    # means partial path, create new path from i to paper
+            records.append((row['Author'], row['Title'], row['Year'],
+                            row['Category'], row['Url'],
+                            int(row['Citations'])))
+    return records
 
-        csvfile.close()
-        return top_list
 
-def _path(cat: List[str], paper: PaperTree) -> PaperTree:
-    """Return instance of PaperTree representing path from cat[0] to
-    leaf <paper>.
+def _read_cache(cache_file: str, filename: str,
+                key: Tuple[int, int]) -> Optional[List[Record]]:
+    """Return the records stored in <cache_file> for the data file
+    <filename> with the given (modification time, size) <key>, or None if
+    the cache does not exist, is for something else, or cannot be read.
     """
-    leaves = [paper]
-    backward_cat = cat
-    backward_cat.reverse()
-    i = 0
-    while i < len(backward_cat):
-        leaves.append(PaperTree(backward_cat[i], [leaves[i]]))
-        i += 1
-    return leaves[-1]
-
-def _names_list(trees: List[TMTree]) -> List[str]:
-    """Return list of names of the trees in list <trees>.
+    name = os.fsencode(os.path.abspath(filename))
+    try:
+        with open(cache_file, 'rb') as cache:
+            header = cache.read(16)
+            if (len(header) != 16 or header[:8] != CACHE_MAGIC or
+                    header[8:].strip() != sys.byteorder.encode('ascii')):
+                return None
+            meta = array('q')
+            meta.fromfile(cache, 4 + _STRING_FIELDS)
+            count, mtime, size, name_length = meta[:4]
+            # Damaged counts or lengths must not make fromfile allocate more
+            # than the file holds.
+            expected = (len(header) + meta.itemsize * len(meta) + name_length
+                        + meta.itemsize * count * (1 + _STRING_FIELDS)
+                        + sum(meta[4:]))
+            if (min(meta[:1] + meta[3:]) < 0 or
+                    expected != os.fstat(cache.fileno()).st_size):
+                return None
+            if (mtime, size) != key or cache.read(name_length) != name:
+                return None
+            citations = array('q')
+            citations.fromfile(cache, count)
+            columns = []
+            for text_length in meta[4:]:
+                lengths = array('q')
+                lengths.fromfile(cache, count)
+                text = cache.read(text_length).decode('utf-8',
+                                                      'surrogatepass')
+                columns.append(_split(text, lengths))
+    except (OSError, EOFError, ValueError):
+        return None
+    if None in columns:
+        return None
+    return list(zip(*columns, citations))
+
+
+def _split(text: str, lengths: array) -> Optional[List[str]]:
+    """Return <text> split into strings of the given <lengths>, or None if
+    the lengths do not add up to the length of <text>.
     """
-    names = []
-    for tree in trees:
-        names.append(tree._name)
-    return names
+    if sum(lengths) != len(text):
+        return None
+    strings = []
+    offset = 0
+    for length in lengths:
+        strings.append(text[offset:offset + length])
+        offset += length
+    return strings
+
+
+def _write_cache(cache_file: str, filename: str, key: Tuple[int, int],
+                 records: List[Record]) -> None:
+    """Save <records>, parsed from the data file <filename> with the given
+    (modification time, size) <key>, to <cache_file>.
+
+    The file holds a header (CACHE_MAGIC, the byte order, the number of
+    records, <key>, the length of the path of <filename> and the length of
+    each string field), the path itself, and the citations as an array of
+    machine integers. Then, for each string field, it holds the length of
+    the field in every record, followed by all of their values as one UTF-8
+    blob. Nothing in the file is ever run, unlike a pickle.
+
+    The cache is written to a temporary file first and then moved into
+    place, so a reader never sees a partly written cache.
+    """
+    name = os.fsencode(os.path.abspath(filename))
+    citations = array('q', [record[-1] for record in records])
+    lengths = []
+    texts = []
+    for field in range(_STRING_FIELDS):
+        values = [record[field] for record in records]
+        lengths.append(array('q', [len(value) for value in values]))
+        texts.append(''.join(values).encode('utf-8', 'surrogatepass'))
+    meta = array('q', [len(records), key[0], key[1], len(name)] +
+                 [len(text) for text in texts])
+
+    temp = cache_file + '.tmp'
+    with open(temp, 'wb') as cache:
+        cache.write(CACHE_MAGIC + sys.byteorder.encode('ascii').ljust(8))
+        meta.tofile(cache)
+        cache.write(name)
+        citations.tofile(cache)
+        for field_lengths, text in zip(lengths, texts):
+            field_lengths.tofile(cache)
+            cache.write(text)
+    os.replace(temp, cache_file)
 
 
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
-        'allowed-import-modules': ['python_ta', 'typing', 'csv', 'tm_trees'],
-        'allowed-io': ['_children'],
+        'allowed-import-modules': ['python_ta', 'typing', 'csv', 'os',
+                                   'sys', 'time', 'array', 'itertools',
+                                   'tm_trees'],
+        'allowed-io': ['_parse_records', '_read_cache', '_write_cache',
+                       'stream_paper_tree'],
         'max-args': 8
     })
\ No newline at end of file
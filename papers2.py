@@ -55,6 +55,7 @@ class PaperTree(TMTree):
     """
     _authors: str
     _doi: str
+    __slots__ = ('_authors', '_doi')
 
     def __init__(self, name: str, subtrees: List[TMTree], authors: str = '',
                  doi: str = '', citations: int = 0, by_year: bool = True,
@@ -0,0 +1,254 @@
+"""Treemaps of any table
+
+=== Module Description ===
+This module contains TableTree, a TMTree for the rows of any table, grouped
+by a list of its columns, and load_table, which reads one from a CSV or
+JSON Lines file.
+
+For example, a table of storage usage with the columns team, project,
+service and bytes can be shown grouped by team, then project, then service,
+with each service sized by the total bytes of its rows.
+
+Rather than walking a tree for each row, load_table turns each grouping
+column into an array of integer codes (one per distinct value), numbers the
+groups at every level in order of their first row, sorts the rows by those
+numbers with NumPy, and finds the groups at every level from where the codes
+change. The totals of the last level are added up with a single reduction,
+and the tree is then built in one pass with build_tree. Apart from the
+distinct values, only a few numbers per row are kept in memory, so tables
+with tens of millions of rows can be loaded.
+
+NumPy is needed to load a table.
+"""
+from __future__ import annotations
+import csv
+import json
+import os
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+from tm_trees import TMTree, build_tree
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The name used for a missing or empty value of a grouping column.
+MISSING = '(none)'
+
+# The file extensions read as JSON Lines; any other file is read as CSV.
+JSONL_EXTENSIONS = ['.jsonl', '.ndjson']
+
+
+class TableTree(TMTree):
+    """A tree representation of the rows of a table, grouped by some of its
+    columns.
+
+    Each level of the tree below the root groups the rows by one column, and
+    each leaf is a group of rows with the same value in every grouping
+    column. The data_size of a leaf is the total of the size column over
+    its rows, rounded to a whole number.
+
+    === Private Attributes ===
+    _column:
+        The column whose value is the name of this tree, or None for the
+        root.
+    """
+    _column: Optional[str]
+    __slots__ = ('_column',)
+
+    def __init__(self, name: str, subtrees: List[TMTree],
+                 column: Optional[str] = None, data_size: int = 0) -> None:
+        """Initialize a new TableTree with the given <name> and <subtrees>,
+        for the rows whose value in <column> is <name>.
+        """
+        TMTree.__init__(self, name, subtrees, data_size)
+        self._column = column
+
+    def get_separator(self) -> str:
+        """Return the string used to separate names in the string
+        representation of a path from the tree root to this tree.
+        """
+        return ' / '
+
+    def get_suffix(self) -> str:
+        """Return the name of the column this tree groups by.
+        """
+        if self._column is None:
+            return ''
+        return ' ({})'.format(self._column)
+
+
+def load_table(source: str, hierarchy: List[str], size: str,
+               name: Optional[str] = None) -> TableTree:
+    """Return a TableTree called <name> (or the file name of <source>) for
+    the rows of the table in the file <source>, grouped by the columns in
+    <hierarchy> in turn, with leaves sized by the column <size>.
+
+    <source> is a JSON Lines file (one object per line) if its extension is
+    in JSONL_EXTENSIONS, and a CSV file with a header row otherwise. Missing
+    or empty values of the grouping columns are shown as MISSING, and a
+    missing or empty size counts as 0. Blank lines are skipped, and the
+    fields missing from the end of a short CSV row are empty.
+
+    The subtrees of every tree are in the order their first row appears in
+    <source>.
+
+    Raise ImportError if NumPy is not installed, and ValueError if a size is
+    not a number, or if the header of a CSV file or a row of a JSON Lines
+    file does not have one of the columns.
+
+    Precondition: hierarchy is not empty.
+    """
+    if np is None:
+        raise ImportError('loading a table requires NumPy')
+    if name is None:
+        name = os.path.basename(source)
+
+    values = [{} for _ in hierarchy]
+    codes = [array('i') for _ in hierarchy]
+    sizes = array('d')
+    for row_values, row_size in _read_rows(source, hierarchy, size):
+        for level, value in enumerate(row_values):
+            codes[level].append(values[level].setdefault(value,
+                                                         len(values[level])))
+        sizes.append(row_size)
+
+    names, parents, totals, columns = _group(
+        [np.frombuffer(column, dtype=np.int32) for column in codes],
+        np.frombuffer(sizes, dtype=np.float64),
+        [list(level_values) for level_values in values], hierarchy)
+    names[0] = name
+    return build_tree(TableTree, names, parents, totals,
+                      {'_column': columns})
+
+
+def _read_rows(source: str, hierarchy: List[str],
+               size: str) -> Iterator[Tuple[List[str], float]]:
+    """Yield the values of the columns in <hierarchy> and the value of the
+    column <size> for each row of the table in <source>, as load_table reads
+    them.
+    """
+    if os.path.splitext(source)[1].lower() in JSONL_EXTENSIONS:
+        with open(source) as jsonl:
+            for number, line in enumerate(jsonl, 1):
+                if line.strip() != '':
+                    row = json.loads(line)
+                    for column in hierarchy + [size]:
+                        if column not in row:
+                            raise ValueError('{} line {} has no column {!r}'
+                                             .format(source, number, column))
+                    yield _row(row, hierarchy, size)
+    else:
+        with open(source, newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader, [])
+            for column in hierarchy + [size]:
+                if column not in header:
+                    raise ValueError('{} has no column {!r}'.format(source,
+                                                                    column))
+            positions = [header.index(column) for column in hierarchy]
+            size_position = header.index(size)
+            for row in reader:
+                if row == []:
+                    continue
+                # The missing trailing fields of a short row are empty.
+                row.extend([''] * (len(header) - len(row)))
+                row_values = [row[i] or MISSING for i in positions]
+                yield row_values, float(row[size_position] or 0)
+
+
+def _row(row: Dict[str, object], hierarchy: List[str],
+         size: str) -> Tuple[List[str], float]:
+    """Return the values of the columns in <hierarchy> and the value of the
+    column <size> in <row>.
+    """
+    row_values = []
+    for column in hierarchy:
+        value = row.get(column)
+        if value is None or value == '':
+            row_values.append(MISSING)
+        else:
+            row_values.append(str(value))
+    row_size = row.get(size)
+    if row_size is None or row_size == '':
+        return row_values, 0.0
+    return row_values, float(row_size)
+
+
+def _group(codes: List[np.ndarray], sizes: np.ndarray,
+           values: List[List[str]], hierarchy: List[str]
+           ) -> Tuple[List[str], List[int], List[int], List[Optional[str]]]:
+    """Return the names, parents, sizes and columns of the nodes of the tree
+    that groups the rows with the given <codes> (one array per level) and
+    <sizes>, numbered as build_tree expects. Node 0 is the root, and is
+    named None.
+
+    The code of a row at a level is the index of its value in the list of
+    <values> of that level.
+    """
+    names = [None]
+    parents = [0]
+    totals = [0]
+    columns = [None]
+    if len(sizes) == 0:
+        return names, parents, totals, columns
+
+    # np.lexsort sorts by its last key first. Sorting by the groups rather
+    # than the codes keeps the subtrees of every tree in the order of their
+    # first row.
+    order = np.lexsort(_number_groups(codes)[::-1])
+    sorted_codes = [level_codes[order] for level_codes in codes]
+    changed = np.zeros(len(order) - 1, dtype=bool)
+    parent_starts = np.array([0])
+    parent_nodes = np.array([0])
+    for level, level_codes in enumerate(sorted_codes):
+        # A group starts wherever the code at this level or any level above
+        # it changes.
+        changed |= level_codes[1:] != level_codes[:-1]
+        starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        first_node = len(names)
+        parent_index = np.searchsorted(parent_starts, starts,
+                                       side='right') - 1
+        level_values = values[level]
+        names.extend(level_values[code]
+                     for code in level_codes[starts].tolist())
+        parents.extend(parent_nodes[parent_index].tolist())
+        columns.extend([hierarchy[level]] * len(starts))
+        if level == len(codes) - 1:
+            group_sizes = np.add.reduceat(sizes[order], starts)
+            totals.extend(np.rint(group_sizes).astype(np.int64).tolist())
+        else:
+            totals.extend([0] * len(starts))
+        parent_starts = starts
+        parent_nodes = np.arange(first_node, first_node + len(starts))
+    return names, parents, totals, columns
+
+
+def _number_groups(codes: List[np.ndarray]) -> List[np.ndarray]:
+    """Return, for each level, the number of the group of each row at that
+    level, where the groups (rows with the same codes at that level and
+    every level above it) are numbered in the order of their first row.
+    """
+    numbers = []
+    groups = np.zeros(len(codes[0]), dtype=np.int64)
+    for level_codes in codes:
+        keys = groups * (int(level_codes.max()) + 1) + level_codes
+        _, first, inverse = np.unique(keys, return_index=True,
+                                      return_inverse=True)
+        ranks = np.empty(len(first), dtype=np.int64)
+        ranks[np.argsort(first)] = np.arange(len(first))
+        groups = ranks[inverse.reshape(-1)]
+        numbers.append(groups)
+    return numbers
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'csv', 'json', 'os', 'array', 'numpy',
+            'tm_trees', '__future__'
+        ],
+        'allowed-io': ['_read_rows']
+    })
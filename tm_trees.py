@@ -17,10 +17,20 @@ concrete implementation of a subclass to represent files and folders on your
 computer's file system.
 """
 from __future__ import annotations
+import gc
 import os
 import math
+from bisect import bisect_left
 from random import randint
-from typing import List, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
+
+# The treemap algorithms that update_rectangles can use.
+SLICE_AND_DICE = 'slice-and-dice'
+SQUARIFIED = 'squarified'
+
+# The smallest width and height, in pixels, of a tree whose subtrees are
+# laid out and displayed in the visualiser. See TMTree.set_min_size.
+MIN_RECT_SIZE = 2
 
 
 class TMTree:
@@ -55,6 +65,36 @@ class TMTree:
         as a subtree, or None if this tree is not part of a larger tree.
     _expanded:
         Whether or not this tree is considered expanded for visualization.
+    _dirty:
+        Whether the data_size of this tree or one of its descendants, or the
+        list of subtrees of this tree or one of its descendants, has changed
+        since this tree's rectangles were last updated.
+    _hit_index:
+        An index of the rectangles of this tree's subtrees for
+        get_tree_at_position, or None if it has not been built since the
+        rectangles or the subtrees last changed. See _build_hit_index.
+    _root_state:
+        The _display_list and _path_index of this tree, or None if both are
+        None. These are almost only ever set on the root of a whole tree, so
+        they share one slot rather than taking two slots in every tree.
+    _display_list:
+        The result of the last call to get_rectangles on this tree, together
+        with the display version it was computed at, or None. Kept in
+        _root_state.
+    _layout:
+        The treemap algorithm set for this tree with set_layout, or None if
+        it uses the same one as its parent.
+    _culled:
+        Whether this tree has subtrees but its rectangle was too small for
+        them to be laid out the last time its rectangles were updated. It is
+        then displayed as a single rectangle, like a collapsed tree.
+    _path_string:
+        The result of get_path_string() for this tree, or None if it has not
+        been computed since this tree or its parent last changed.
+    _path_index:
+        For the root of a tree, the trees in it by their path below the root
+        (see _path_key), or None if they have not been indexed yet. Always
+        None for any other tree. See get_tree_at_path. Kept in _root_state.
 
     === Representation Invariants ===
     - data_size >= 0
@@ -82,6 +122,27 @@ class TMTree:
     _subtrees: List[TMTree]
     _parent_tree: Optional[TMTree]
     _expanded: bool
+    _dirty: bool
+    _hit_index: Optional[Tuple[Optional[int], List[int], List[int]]]
+    _root_state: Optional[_RootState]
+    _layout: Optional[str]
+    _culled: bool
+    _path_string: Optional[str]
+
+    # Trees have a fixed set of attributes, so they are kept in slots instead
+    # of a per-instance dictionary, which saves memory on large trees.
+    __slots__ = ('rect', 'data_size', '_colour', '_name', '_subtrees',
+                 '_parent_tree', '_expanded', '_dirty', '_hit_index',
+                 '_root_state', '_layout', '_culled', '_path_string')
+
+    # The smallest width and height, in pixels, of a tree whose subtrees are
+    # laid out and displayed, shared by all trees. Every tree is laid out
+    # unless this is set with set_min_size.
+    _min_size = 0
+
+    # The display version, shared by all trees. It is increased every time
+    # the rectangles, sizes, subtrees or expanded state of any tree change.
+    _version = 0
 
     def __init__(self, name: str, subtrees: List[TMTree],
                  data_size: int = 0) -> None:
@@ -101,6 +162,12 @@ class TMTree:
         self._name = name
         self._subtrees = subtrees[:]
         self._parent_tree = None
+        self._dirty = True
+        self._hit_index = None
+        self._root_state = None
+        self._layout = None
+        self._culled = False
+        self._path_string = None
 
         # You will change this in Task 5
         # if len(self._subtrees) > 0:
@@ -119,22 +186,88 @@ class TMTree:
         elif subtrees == []:
             self.data_size = data_size #if file then its size would be passed in
         else:
+            self._take_path_index(subtrees)
             new_size = 0
             for subtree in subtrees:
+                subtree._path_index = None
                 subtree._parent_tree = self
                 subtree._expanded = False
                 new_size += subtree.data_size
             self.data_size = new_size
 
+    @property
+    def _display_list(self) -> Optional[Tuple[int, List[Tuple[
+            Tuple[int, int, int, int], Tuple[int, int, int]]]]]:
+        """The _display_list of this tree, kept in _root_state.
+        """
+        if self._root_state is None:
+            return None
+        return self._root_state.display_list
+
+    @_display_list.setter
+    def _display_list(self, value: Optional[Tuple[int, List[Tuple[
+            Tuple[int, int, int, int], Tuple[int, int, int]]]]]) -> None:
+        if self._root_state is None:
+            if value is None:
+                return
+            self._root_state = _RootState()
+        self._root_state.display_list = value
+
+    @property
+    def _path_index(self) -> Optional[Dict[str, TMTree]]:
+        """The _path_index of this tree, kept in _root_state.
+        """
+        if self._root_state is None:
+            return None
+        return self._root_state.path_index
+
+    @_path_index.setter
+    def _path_index(self, value: Optional[Dict[str, TMTree]]) -> None:
+        if self._root_state is None:
+            if value is None:
+                return
+            self._root_state = _RootState()
+        self._root_state.path_index = value
+
     def is_empty(self) -> bool:
         """Return True iff this tree is empty.
         """
         return self._name is None
 
-    def update_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
+    def update_rectangles(self, rect: Tuple[int, int, int, int],
+                          incremental: bool = False) -> None:
         """Update the rectangles in this tree and its descendents using the
         treemap algorithm to fill the area defined by pygame rectangle <rect>.
+
+        The layout algorithm is the one set with set_layout on this tree or
+        its nearest ancestor, or SLICE_AND_DICE if there is none.
+
+        If <incremental> is True, skip every tree whose rectangle stays the
+        same and that is not dirty, along with all of its descendants, since
+        their rectangles cannot have changed either.
         """
+        layout = SLICE_AND_DICE
+        tree = self
+        while tree is not None:
+            if tree._layout is not None:
+                layout = tree._layout
+                break
+            tree = tree._parent_tree
+        self._update_rectangles(rect, incremental, layout)
+
+    def _update_rectangles(self, rect: Tuple[int, int, int, int],
+                           incremental: bool, layout: str) -> None:
+        """Update the rectangles in this tree and its descendents as in
+        update_rectangles, using <layout> unless this tree has its own.
+        """
+        if incremental and not self._dirty and self.rect == rect:
+            return
+        self._dirty = False
+        self._hit_index = None
+        self._touch()
+        if self._layout is not None:
+            layout = self._layout
+        self._culled = False
         if self.data_size == 0:
             pass
         elif self._subtrees == []:
@@ -144,59 +277,190 @@ class TMTree:
             width = rect[2]
             height = rect[3]
             total = self.data_size
-            if width > height:
-                self._wide_update(rect, total)
+            if width < TMTree._min_size or height < TMTree._min_size:
+                # The subtrees would be too small to see. They are laid out
+                # once this tree is given a large enough rectangle again.
+                self._culled = True
+                self._clear_subtree_rects()
+            elif layout == SQUARIFIED and width > 0 and height > 0:
+                self._squarified_update(rect, total, incremental, layout)
+            elif width > height:
+                self._wide_update(rect, total, incremental, layout)
             elif height >= width:
-                self._tall_update(rect, total)
+                self._tall_update(rect, total, incremental, layout)
+
+    def _update_subtree(self, subtree: TMTree,
+                        rect: Tuple[int, int, int, int],
+                        incremental: bool, layout: str) -> None:
+        """Update the rectangles of <subtree>, one of this tree's subtrees,
+        to fill <rect>.
+        """
+        if subtree.data_size == 0:
+            # update_rectangles ignores empty trees, but they are still
+            # given their place in the layout of their parent.
+            subtree.rect = rect
+        else:
+            subtree._update_rectangles(rect, incremental, layout)
 
-    def _wide_update(self, rect: Tuple[int, int, int, int], total: int) -> None:
+    def _wide_update(self, rect: Tuple[int, int, int, int], total: int,
+                     incremental: bool = False,
+                     layout: str = SLICE_AND_DICE) -> None:
         """Helper function for update_rectangles, handles cases where
         width is greater than height.
         """
         x, y, width, height = rect
-        i = 0
-        last = (len(self._subtrees) - 1)
-        while i in range(len(self._subtrees)):
-            if i == last:
-                proportion = self._subtrees[i].data_size / total
-                new_width = proportion * width
-                self._subtrees[i].rect = x, y, math.ceil(
-                    new_width), height
-                x = x + math.ceil(new_width)
-                self._subtrees[i].update_rectangles(
-                    self._subtrees[i].rect)
+        last = self._subtrees[-1]
+        for subtree in self._subtrees:
+            proportion = subtree.data_size / total
+            new_width = proportion * width
+            if subtree is last:
+                new_width = math.ceil(new_width)
             else:
-                proportion = self._subtrees[i].data_size / total
-                new_width = proportion * width
-                self._subtrees[i].rect = x, y, math.trunc(
-                    new_width), height
-                x = x + math.trunc(new_width)
-                self._subtrees[i].update_rectangles(
-                    self._subtrees[i].rect)
-            i += 1
-
-    def _tall_update(self, rect: Tuple[int, int, int, int], total: int) -> None:
+                new_width = math.trunc(new_width)
+            self._update_subtree(subtree, (x, y, new_width, height),
+                                 incremental, layout)
+            x = x + new_width
+
+    def _tall_update(self, rect: Tuple[int, int, int, int], total: int,
+                     incremental: bool = False,
+                     layout: str = SLICE_AND_DICE) -> None:
         x, y, width, height = rect
+        last = self._subtrees[-1]
+        for subtree in self._subtrees:
+            proportion = subtree.data_size / total
+            new_height = proportion * height
+            if subtree is last:
+                new_height = math.ceil(new_height)
+            else:
+                new_height = math.trunc(new_height)
+            self._update_subtree(subtree, (x, y, width, new_height),
+                                 incremental, layout)
+            y = y + new_height
+
+    def _squarified_update(self, rect: Tuple[int, int, int, int], total: int,
+                           incremental: bool = False,
+                           layout: str = SQUARIFIED) -> None:
+        """Helper function for update_rectangles, handles the SQUARIFIED
+        layout.
+
+        The subtrees are placed from largest to smallest in rows along the
+        shorter side of the space that is left, and each row takes subtrees
+        for as long as that does not make its worst aspect ratio worse
+        (Bruls, Huizing and van Wijk, "Squarified Treemaps"). Empty subtrees
+        get an empty rectangle at the top left corner.
+
+        Precondition: both the width and height of <rect> are positive.
+        """
+        x, y, width, height = rect
+        order = sorted(self._subtrees, key=lambda t: t.data_size,
+                       reverse=True)
+        scale = width * height / total
+        areas = [subtree.data_size * scale for subtree in order
+                 if subtree.data_size > 0]
+        for subtree in order[len(areas):]:
+            self._update_subtree(subtree, (x, y, 0, 0), incremental, layout)
+
+        # The space that is left, as floats. The rectangles of the subtrees
+        # are rounded from these at the end, so neighbours share an edge.
+        left, top, free_width, free_height = (float(x), float(y),
+                                              float(width), float(height))
         i = 0
-        last = (len(self._subtrees) - 1)
-        while i in range(len(self._subtrees)):
-            if i == last:
-                proportion = self._subtrees[i].data_size / total
-                new_height = proportion * height
-                self._subtrees[i].rect = x, y, width, math.ceil(
-                    new_height)
-                y = y + math.ceil(new_height)
-                self._subtrees[i].update_rectangles(
-                    self._subtrees[i].rect)
+        while i < len(areas):
+            side = min(free_width, free_height)
+            row_area = areas[i]
+            worst = _worst_ratio(areas[i], areas[i], row_area, side)
+            j = i + 1
+            while j < len(areas):
+                ratio = _worst_ratio(areas[i], areas[j], row_area + areas[j],
+                                     side)
+                if ratio > worst:
+                    break
+                worst = ratio
+                row_area += areas[j]
+                j += 1
+
+            vertical = free_width >= free_height
+            if j == len(areas):
+                thickness = free_width if vertical else free_height
+            else:
+                thickness = row_area / side
+            start = top if vertical else left
+            position = start
+            for k in range(i, j):
+                if k == j - 1:
+                    end = start + side
+                else:
+                    end = position + areas[k] / thickness
+                if vertical:
+                    new_rect = _round_rect(left, position, left + thickness,
+                                           end)
+                else:
+                    new_rect = _round_rect(position, top, end,
+                                           top + thickness)
+                self._update_subtree(order[k], new_rect, incremental, layout)
+                position = end
+
+            if vertical:
+                left += thickness
+                free_width -= thickness
             else:
-                proportion = self._subtrees[i].data_size / total
-                new_height = proportion * height
-                self._subtrees[i].rect = x, y, width, math.trunc(
-                    new_height)
-                y = y + math.trunc(new_height)
-                self._subtrees[i].update_rectangles(
-                    self._subtrees[i].rect)
-            i += 1
+                top += thickness
+                free_height -= thickness
+            i = j
+
+    @classmethod
+    def set_min_size(cls, size: int) -> None:
+        """Set the smallest width and height, in pixels, of a tree whose
+        subtrees are laid out and displayed to <size>, for every tree.
+
+        A tree with a narrower or shorter rectangle is displayed as a single
+        rectangle, so the time taken to lay out and display a treemap depends
+        on the size of the screen rather than the number of trees. The
+        rectangles of its descendants are set to (0, 0, 0, 0). The default
+        is 0, so that every tree is laid out. The rectangles must be updated
+        without <incremental> for this to take effect.
+
+        Precondition: size >= 0
+        """
+        TMTree._min_size = size
+
+    def _clear_subtree_rects(self) -> None:
+        """Set the rectangles of the descendants of this tree to
+        (0, 0, 0, 0), since they are not laid out.
+
+        A tree whose rectangle is (0, 0, 0, 0) has no descendant with any
+        other rectangle, so it is not cleared again.
+        """
+        stack = list(self._subtrees)
+        while stack:
+            tree = stack.pop()
+            if tree.rect != (0, 0, 0, 0):
+                tree.rect = (0, 0, 0, 0)
+                tree._hit_index = None
+                stack.extend(tree._subtrees)
+
+    def set_layout(self, layout: Optional[str]) -> None:
+        """Use the treemap algorithm <layout> (SLICE_AND_DICE or SQUARIFIED)
+        for this tree and those of its descendants that do not have their
+        own, or the algorithm of this tree's parent if <layout> is None.
+
+        This takes effect the next time the rectangles are updated, even
+        if they are updated with <incremental>.
+        """
+        self._layout = layout
+        tree = self._parent_tree
+        while tree is not None:
+            tree._dirty = True
+            tree = tree._parent_tree
+        # Every descendant that uses this tree's layout must be laid out
+        # again; those with their own layout, and their descendants, do not.
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            tree._dirty = True
+            for subtree in tree._subtrees:
+                if subtree._layout is None:
+                    stack.append(subtree)
 
     def get_rectangles(self) -> List[Tuple[Tuple[int, int, int, int],
                                            Tuple[int, int, int]]]:
@@ -204,20 +468,49 @@ class TMTree:
         rooted at this tree. Each tuple consists of a tuple that defines the
         appropriate pygame rectangle to display for a leaf, and the colour
         to fill it with.
+
+        A tree whose rectangle was too small for its subtrees to be laid out
+        (see set_min_size) is displayed as a single rectangle of its colour.
+
+        The list is cached until the display version changes, so it must not
+        be modified by the caller.
+        """
+        if self._display_list is not None and \
+                self._display_list[0] == TMTree._version:
+            return self._display_list[1]
+        the_rect = []
+        self._collect_rectangles(the_rect)
+        self._display_list = TMTree._version, the_rect
+        return the_rect
+
+    def _collect_rectangles(self, the_rect: List[
+            Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]) -> None:
+        """Append the tuples returned by get_rectangles for this tree to
+        <the_rect>.
         """
         if self.data_size == 0:
-            return []
+            pass
         elif self._subtrees == []:
-            rect_up = self.rect, self._colour
-            return [rect_up]
-        elif not self._expanded:
-            rect_up = self.rect, self._colour
-            return [rect_up]
+            the_rect.append((self.rect, self._colour))
+        elif not self._expanded or self._culled:
+            the_rect.append((self.rect, self._colour))
         else:
-            the_rect = []
             for subtree in self._subtrees:
-                the_rect.extend(subtree.get_rectangles())
-            return the_rect
+                subtree._collect_rectangles(the_rect)
+
+    def get_version(self) -> int:
+        """Return the display version.
+
+        The display version changes whenever the rectangles, sizes, subtrees
+        or expanded state of a tree change, so the displayed tree only needs
+        to be drawn again when it is different from the last version drawn.
+        """
+        return TMTree._version
+
+    def _touch(self) -> None:
+        """Record that the display of this tree has changed.
+        """
+        TMTree._version += 1
 
     def get_tree_at_position(self, pos: Tuple[int, int]) -> Optional[TMTree]:
         """Return the leaf in the displayed-tree rooted at this tree whose
@@ -233,15 +526,52 @@ class TMTree:
             return None
         elif self._subtrees == []:
             return self
-        elif not self._expanded:
+        elif not self._expanded or self._culled:
             return self
         else:
-            for subtree in self._subtrees:
-                result = subtree.get_tree_at_position(pos)
+            if self._hit_index is None:
+                self._hit_index = self._build_hit_index()
+            axis, starts, ends = self._hit_index
+            if axis is None:
+                i = 0
+            else:
+                # Every subtree before i ends before pos, so none of them
+                # can contain it.
+                i = bisect_left(ends, pos[axis])
+            while i < len(self._subtrees):
+                if axis is not None and starts[i] > pos[axis]:
+                    # This subtree and all later ones start after pos.
+                    return None
+                result = self._subtrees[i].get_tree_at_position(pos)
                 if result is not None:
                     return result
+                i += 1
             return None
 
+    def _build_hit_index(self) -> Tuple[Optional[int], List[int], List[int]]:
+        """Return an index of the rectangles of this tree's subtrees.
+
+        The index is (axis, starts, ends), where axis is 0 if the subtrees
+        are in order along the x axis, 1 if they are in order along the y
+        axis, and None otherwise. The subtrees are in order along an axis if
+        both their start and end coordinates on it never decrease. In that
+        case, starts and ends hold those coordinates, so that the subtrees
+        that may contain a position can be found with a binary search.
+        """
+        for axis in [0, 1]:
+            starts = []
+            ends = []
+            for subtree in self._subtrees:
+                start = subtree.rect[axis]
+                end = start + subtree.rect[axis + 2]
+                if starts != [] and (start < starts[-1] or end < ends[-1]):
+                    break
+                starts.append(start)
+                ends.append(end)
+            else:
+                return axis, starts, ends
+        return None, [], []
+
     def _get_rect(self) -> Tuple[int, int, int, int]:
         """Return tuple of upper left coordinates and lower right coordinates.
         >>>self.rect
@@ -274,11 +604,20 @@ class TMTree:
     def move(self, destination: TMTree) -> None:
         """If this tree is a leaf, and <destination> is not a leaf, move this
         tree to be the last subtree of <destination>. Otherwise, do nothing.
+
+        The data_size of the old and new ancestors of this tree is updated.
         """
         if self._subtrees == [] and destination._subtrees != []:
+            self._dirty = True
+            self._parent_tree._add_size(-self.data_size)
+            self._unindex_paths()
             self._parent_tree._subtrees.remove(self)
-            self._parent_tree = destination
-            destination._subtrees.append(self)
+            self._parent_tree._hit_index = None
+            # The old parent's suffix may change if this was its last subtree.
+            self._parent_tree._path_string = None
+            self._touch()
+            destination._add_subtree(self)
+            destination._add_size(self.data_size)
             return None
         else:
             return None
@@ -290,6 +629,8 @@ class TMTree:
         some change is made.
 
         Do nothing if this tree is not a leaf.
+
+        The data_size of every ancestor of this tree is updated to match.
         """
         if self._subtrees != []:
             return None
@@ -299,20 +640,51 @@ class TMTree:
             if factor > 0:
                 new_size = math.ceil(self.data_size * (1 + factor))
                 if new_size >= 1:
-                    self.data_size = new_size
+                    self._add_size(new_size - self.data_size)
                     return None
                 else:
                     return None
             elif factor < 0:
                 new_size = math.floor(self.data_size * (1 + factor))
                 if new_size >= 1:
-                    self.data_size = new_size
+                    self._add_size(new_size - self.data_size)
                     return None
                 else:
                     return None
             else:
                 return None
 
+    def _add_subtree(self, subtree: TMTree) -> None:
+        """Add <subtree> as the last subtree of this tree.
+
+        The data_size of this tree and its ancestors is not updated.
+        """
+        subtree._parent_tree = self
+        subtree._path_index = None
+        self._subtrees.append(subtree)
+        self._hit_index = None
+        self._path_string = None
+        subtree._clear_path_strings()
+        index = self._get_root()._path_index
+        if index is not None:
+            subtree._index_paths(index, self._path_key() +
+                                 subtree.get_separator() + subtree._name)
+        self._touch()
+
+    def _add_size(self, change: int) -> None:
+        """Add <change> to the data_size of this tree and of each of its
+        ancestors, and mark them all as dirty.
+
+        This keeps the sizes of the whole tree consistent after a change to
+        one leaf, without calling update_data_sizes on the whole tree.
+        """
+        tree = self
+        while tree is not None:
+            tree.data_size += change
+            tree._dirty = True
+            tree = tree._parent_tree
+        self._touch()
+
     def expand(self) -> None:
         """Set the value of this tree's _expanded attribute to True, adding
         the tree's children to the displayed tree.
@@ -326,6 +698,7 @@ class TMTree:
             pass
         else:
             self._expanded = True
+            self._touch()
 
     def expand_all(self) -> None:
         """Fully expand the tree rooted at selected tree in displayed tree.
@@ -341,6 +714,7 @@ class TMTree:
             pass
         else:
             self._expanded = True
+            self._touch()
             for subtree in self._subtrees:
                 subtree.expand_all()
 
@@ -352,6 +726,7 @@ class TMTree:
         if self._parent_tree is None:
             pass
         elif self._subtrees == []:
+            self._touch()
             self._parent_tree._expanded = False
             #self._parent_tree._expanded = False
             for subtree in self._parent_tree._subtrees:
@@ -373,6 +748,7 @@ class TMTree:
         """
         if self._parent_tree is None:
             self._expanded = False
+            self._touch()
             for subtree in self._subtrees:
                 subtree.collapse_all()
         else:
@@ -383,18 +759,137 @@ class TMTree:
         """Return a string representing the path containing this tree
         and its ancestors, using the separator for this tree between each
         tree's name. If <final_node>, then add the suffix for the tree.
+
+        The full path string of each tree is cached until the tree is moved
+        or its subtrees change, since the visualiser asks for it every frame.
         """
-        if self._parent_tree is None:
-            path_str = self._name
-            if final_node:
-                path_str += self.get_suffix()
-            return path_str
-        else:
-            path_str = (self._parent_tree.get_path_string(False) +
-                        self.get_separator() + self._name)
-            if final_node or len(self._subtrees) == 0:
-                path_str += self.get_suffix()
-            return path_str
+        if final_node and self._path_string is not None:
+            return self._path_string
+        path_str = self._get_root()._name + self._path_key()
+        if final_node or (self._parent_tree is not None and
+                          len(self._subtrees) == 0):
+            path_str += self.get_suffix()
+        if final_node:
+            self._path_string = path_str
+        return path_str
+
+    def get_tree_at_path(self, path: str) -> Optional[TMTree]:
+        """Return the tree in the whole tree containing this tree whose
+        path is <path>, or None if there is none.
+
+        A path is a path string (see get_path_string) from the root of the
+        whole tree without the final suffix, e.g. 'workshop/prep/Cats.pdf'
+        for a FileSystemTree. If several trees have the same path, return
+        one of them.
+
+        A tree made by build_tree, or from all the subtrees of one, is
+        indexed by path as it is built; any other tree is indexed on its
+        first lookup. The index is then kept up to date as trees are moved or
+        added, so lookups do not walk the tree.
+        """
+        root = self._get_root()
+        if not path.startswith(root._name):
+            return None
+        if root._path_index is None:
+            root._path_index = {}
+            root._index_paths(root._path_index, '')
+        return root._path_index.get(path[len(root._name):])
+
+    def get_displayed_tree(self) -> TMTree:
+        """Return the tree whose rectangle shows this tree in the treemap:
+        this tree if every one of its ancestors is expanded and had its
+        subtrees laid out, and otherwise the highest ancestor that is
+        collapsed or culled.
+        """
+        displayed = self
+        tree = self._parent_tree
+        while tree is not None:
+            if not tree._expanded or tree._culled:
+                displayed = tree
+            tree = tree._parent_tree
+        return displayed
+
+    def _get_root(self) -> TMTree:
+        """Return the root of the whole tree containing this tree.
+        """
+        tree = self
+        while tree._parent_tree is not None:
+            tree = tree._parent_tree
+        return tree
+
+    def _path_key(self) -> str:
+        """Return the path of this tree below the root of the whole tree:
+        its path without the final suffix or the name of the root, e.g.
+        '/prep/Cats.pdf' for 'workshop/prep/Cats.pdf', or '' for the root.
+
+        The trees are indexed by this key, so the index of a tree stays
+        valid when its root is replaced (see _take_path_index).
+        """
+        parts = []
+        tree = self
+        while tree._parent_tree is not None:
+            parts.append(tree._name)
+            parts.append(tree.get_separator())
+            tree = tree._parent_tree
+        parts.reverse()
+        return ''.join(parts)
+
+    def _take_path_index(self, subtrees: List[TMTree]) -> None:
+        """If <subtrees> are all the subtrees of the root of a tree that
+        has been indexed by path (e.g. one made by build_tree), take over
+        that index for this tree, which becomes their new root.
+        """
+        if subtrees == []:
+            return
+        old_root = subtrees[0]._parent_tree
+        if (old_root is not None and old_root is not self
+                and old_root._parent_tree is None
+                and old_root._path_index is not None
+                and len(old_root._subtrees) == len(subtrees)
+                and all(old is new for old, new
+                        in zip(old_root._subtrees, subtrees))):
+            self._path_index = old_root._path_index
+            self._path_index[''] = self
+            old_root._path_index = None
+
+    def _index_paths(self, index: Dict[str, TMTree], path: str) -> None:
+        """Add this tree, whose path is <path>, and all of its descendants
+        to <index>, keeping any tree already there for the same path.
+        """
+        stack = [(self, path)]
+        while stack:
+            tree, path = stack.pop()
+            index.setdefault(path, tree)
+            for subtree in reversed(tree._subtrees):
+                stack.append((subtree, path + subtree.get_separator() +
+                              subtree._name))
+
+    def _unindex_paths(self) -> None:
+        """Remove this leaf from the path index of its root, if there is
+        one. If another subtree of its parent has the same path, it takes
+        this leaf's place in the index.
+        """
+        index = self._get_root()._path_index
+        if index is not None:
+            path = self._path_key()
+            if index.get(path) is self:
+                del index[path]
+                for subtree in self._parent_tree._subtrees:
+                    if (subtree is not self and subtree._name == self._name
+                            and subtree.get_separator() ==
+                            self.get_separator()):
+                        subtree._index_paths(index, path)
+                        break
+
+    def _clear_path_strings(self) -> None:
+        """Forget the cached path strings of this tree and its
+        descendants.
+        """
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            tree._path_string = None
+            stack.extend(tree._subtrees)
 
     def _closed(self) -> None:
         """Set this tree's _expanded attribute to False.
@@ -417,6 +912,12 @@ class TMTree:
                     subtree._parent_tree = self
                     subtree._parent_check()
 
+    def get_search_names(self) -> List[str]:
+        """Return the names this tree can be found by with a
+        name_search.NameIndex.
+        """
+        return [self._name]
+
     def get_separator(self) -> str:
         """Return the string used to separate names in the string
         representation of a path from the tree root to this tree.
@@ -429,6 +930,145 @@ class TMTree:
         """
         raise NotImplementedError
 
+def _worst_ratio(largest: float, smallest: float, total: float,
+                 side: float) -> float:
+    """Return the worst aspect ratio of a row of rectangles laid along a
+    side of length <side>, whose areas add up to <total> and whose largest
+    and smallest areas are <largest> and <smallest>.
+    """
+    side_squared = side * side
+    total_squared = total * total
+    return max(side_squared * largest / total_squared,
+               total_squared / (side_squared * smallest))
+
+
+class _RootState:
+    """The caches of a tree that are almost only ever kept for the root of a
+    whole tree. See TMTree._root_state.
+
+    === Attributes ===
+    display_list:
+        The _display_list of the tree.
+    path_index:
+        The _path_index of the tree.
+    """
+    display_list: Optional[Tuple[int, List[Tuple[Tuple[int, int, int, int],
+                                                 Tuple[int, int, int]]]]]
+    path_index: Optional[Dict[str, TMTree]]
+    __slots__ = ('display_list', 'path_index')
+
+    def __init__(self) -> None:
+        """Initialize empty caches.
+        """
+        self.display_list = None
+        self.path_index = None
+
+
+def _round_rect(left: float, top: float, right: float,
+                bottom: float) -> Tuple[int, int, int, int]:
+    """Return the pygame rectangle with the given edges, each rounded to the
+    nearest pixel.
+    """
+    x = math.floor(left + 0.5)
+    y = math.floor(top + 0.5)
+    return x, y, math.floor(right + 0.5) - x, math.floor(bottom + 0.5) - y
+
+
+def build_tree(cls: type, names: List[str], parents: List[int],
+               sizes: List[int],
+               attributes: Optional[Dict[str, List[Any]]] = None) -> TMTree:
+    """Return the root of a tree of <cls> nodes, built in one pass without
+    calling <cls>.__init__.
+
+    Node i is called names[i] and is the last subtree so far of node
+    parents[i]. Node 0 is the root, and its parent is ignored. The data_size
+    of a leaf i is sizes[i]; the data_size of every other node is the sum of
+    the data_size of its subtrees, and its entry in <sizes> is ignored.
+
+    Each node's colour is derived from its index, so it is cheap to compute
+    and the same every time the same tree is built. <attributes> maps the
+    name of any other attribute that <cls> needs (e.g. '_authors' for a
+    PaperTree) to its value for each node.
+
+    Precondition: names is not empty, all three lists have the same length,
+    and 0 <= parents[i] < i for every i > 0.
+    """
+    # None of the new nodes can be garbage until the tree is built, so the
+    # cyclic garbage collector, which would otherwise run over and over as
+    # they are allocated, is paused until then.
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _build_nodes(cls, names, parents, sizes, attributes)
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _build_nodes(cls: type, names: List[str], parents: List[int],
+                 sizes: List[int],
+                 attributes: Optional[Dict[str, List[Any]]]) -> TMTree:
+    """Return the root of the tree described by the arguments, as
+    build_tree does.
+    """
+    nodes = []
+    for i in range(len(names)):
+        node = cls.__new__(cls)
+        node.rect = (0, 0, 0, 0)
+        node.data_size = sizes[i]
+        node._colour = _index_colour(i)
+        node._name = names[i]
+        node._subtrees = []
+        node._expanded = False
+        node._dirty = True
+        node._hit_index = None
+        node._root_state = None
+        node._layout = None
+        node._culled = False
+        node._path_string = None
+        if i == 0:
+            node._parent_tree = None
+        else:
+            parent = nodes[parents[i]]
+            if parent._subtrees == []:
+                parent.data_size = 0
+            parent._subtrees.append(node)
+            node._parent_tree = parent
+        nodes.append(node)
+
+    # Every node comes after its parent, so going backwards adds up the
+    # size of each node before it is added to its parent.
+    for i in range(len(nodes) - 1, 0, -1):
+        nodes[parents[i]].data_size += nodes[i].data_size
+
+    if attributes is not None:
+        for name, values in attributes.items():
+            for node, value in zip(nodes, values):
+                setattr(node, name, value)
+
+    # The separators can depend on the attributes, so the nodes are indexed
+    # by path only once these are set.
+    keys = ['']
+    index = {'': nodes[0]}
+    for i in range(1, len(nodes)):
+        node = nodes[i]
+        key = keys[parents[i]] + node.get_separator() + node._name
+        keys.append(key)
+        index.setdefault(key, node)
+    nodes[0]._path_index = index
+    return nodes[0]
+
+
+def _index_colour(index: int) -> Tuple[int, int, int]:
+    """Return a colour for the node with the given <index>.
+
+    The index is scrambled with a multiplicative hash, so that neighbouring
+    nodes get very different colours.
+    """
+    scrambled = (index + 1) * 2654435761 & 0xFFFFFFFF
+    return scrambled >> 24, (scrambled >> 16) & 255, (scrambled >> 8) & 255
+
+
 class FileSystemTree(TMTree):
     """A tree representation of files and folders in a file system.
 
@@ -441,6 +1081,7 @@ class FileSystemTree(TMTree):
     The data_size attribute for regular files is simply the size of the file,
     as reported by os.path.getsize.
     """
+    __slots__ = ()
 
     def __init__(self, path: str) -> None:
         """Store the file tree structure contained in the given file or folder.
@@ -483,6 +1124,7 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'math', 'random', 'os', '__future__'
+            'python_ta', 'typing', 'gc', 'math', 'random', 'os', 'bisect',
+            '__future__'
         ]
     })
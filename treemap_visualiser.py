@@ -17,10 +17,19 @@ concrete subclass, of course), rendering it to the user using pygame,
 and detecting user events like mouse clicks and key presses and responding
 to them.
 """
-from typing import Optional, Tuple
+import time
+from functools import lru_cache
+from typing import List, Optional, Tuple
 import pygame
-from tm_trees import TMTree, FileSystemTree
+from tm_trees import TMTree, MIN_RECT_SIZE
 from papers import PaperTree
+from fs_scanner import DEFAULT_WORKERS, LazyFileSystemTree, \
+    ProgressiveScan, scan_file_system
+from compact_tree import compact_file_system
+from tabular import load_table
+from name_search import SEARCH_LIMIT, NameIndex
+from layouts import NUMPY_ENGINE, PYTHON_ENGINE, aspect_ratios, \
+    numpy_update_rectangles
 
 
 # Screen dimensions and coordinates
@@ -34,134 +43,424 @@ TREEMAP_HEIGHT = HEIGHT - FONT_HEIGHT  # The height of the treemap display.
 # Font to use for the treemap program.
 FONT_FAMILY = 'Consolas'
 
+# The number of rendered text surfaces to keep for reuse.
+TEXT_CACHE_SIZE = 64
 
-def run_visualisation(tree: TMTree) -> None:
+# The minimum time, in seconds, between two layouts of the treemap while a
+# background scan is still adding to the tree.
+SCAN_REFRESH = 0.25
+
+# The maximum number of times per second that the display is drawn.
+FPS = 60
+
+# The colour of the outlines of the trees found by a name search.
+SEARCH_COLOUR = (255, 255, 0)
+
+
+def run_visualisation(tree: TMTree,
+                      scan: Optional[ProgressiveScan] = None,
+                      fps: int = FPS, engine: str = PYTHON_ENGINE,
+                      layout: Optional[str] = None,
+                      min_size: int = MIN_RECT_SIZE) -> None:
     """Display an interactive graphical display of the given tree's treemap.
+
+    If <scan> is not None, it is the background scan building <tree>. Its
+    results are shown as they arrive, and it is stopped when the window is
+    closed. The display is drawn at most <fps> times per second.
+
+    <engine> is the layout engine used to lay out the whole treemap:
+    PYTHON_ENGINE or NUMPY_ENGINE. Both give the same rectangles. Later
+    changes only lay out the affected trees again, using
+    TMTree.update_rectangles.
+
+    If <layout> is not None, it is the treemap algorithm used for the whole
+    tree: SLICE_AND_DICE or SQUARIFIED. The mean and worst aspect ratios of
+    the initial treemap are printed, to compare the algorithms.
+
+    Trees whose rectangle is narrower or shorter than <min_size> pixels are
+    displayed as a single rectangle, without laying out their subtrees.
+
+    Pressing '/' starts a search: the trees whose names contain the text
+    typed are outlined in SEARCH_COLOUR. Enter ends the search, keeping the
+    outlines, and Escape clears it.
     """
 
     # Setup pygame
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
 
+    # Fonts and text rendered in an earlier session may not be valid anymore.
+    _get_font.cache_clear()
+    _get_text_surface.cache_clear()
+
     # Render the initial display of the static treemap.
     render_display(screen, tree, None, None)
-    tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+    tree.set_min_size(min_size)
+    if layout is not None:
+        tree.set_layout(layout)
+    if engine == NUMPY_ENGINE:
+        numpy_update_rectangles(tree, (0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+    else:
+        tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+    if layout is not None:
+        mean, worst = aspect_ratios(tree)
+        print('{} layout: mean aspect ratio {:.2f}, worst {:.2f}'.format(
+            layout, mean, worst))
 
     # Start an event loop to respond to events.
-    event_loop(screen, tree)
+    event_loop(screen, tree, scan, fps)
+    if scan is not None:
+        scan.stop()
+
+
+class DisplayCache:
+    """What render_display drew on the screen last time.
+
+    === Public Attributes ===
+    body:
+        The treemap without the selected and hover outlines, or None if it
+        has not been drawn yet.
+    tree:
+        The tree drawn on body, or None.
+    version:
+        The display version of tree when body was drawn.
+    outlines:
+        The areas of the screen covered by the outlines drawn last time.
+    text:
+        The text drawn at the bottom of the screen last time, or None.
+    """
+    body: Optional[pygame.Surface]
+    tree: Optional[TMTree]
+    version: int
+    outlines: List[pygame.Rect]
+    text: Optional[str]
+
+    def __init__(self) -> None:
+        """Initialize an empty cache, so that everything is drawn next time.
+        """
+        self.body = None
+        self.tree = None
+        self.version = -1
+        self.outlines = []
+        self.text = None
 
 
 def render_display(screen: pygame.Surface, tree: Optional[TMTree],
                    selected_node: Optional[TMTree],
-                   hover_node: Optional[TMTree]) -> None:
+                   hover_node: Optional[TMTree], status: str = '',
+                   cache: Optional[DisplayCache] = None,
+                   matches: Optional[List[TMTree]] = None) -> None:
     """Render a treemap and text display to the given screen.
 
     Use the constants TREEMAP_HEIGHT and FONT_HEIGHT to divide the
     screen vertically into the treemap and text comments.
+    If <status> is not empty, show it before the text for <selected_node>.
+    If <matches> is not None, outline in SEARCH_COLOUR the rectangle that
+    shows each of those trees: its own, or that of the collapsed or culled
+    ancestor it is hidden in.
+
+    If <cache> is not None, it holds what was drawn by the last call. The
+    treemap is then only drawn again if the tree's display version changed;
+    otherwise the old outlines are erased by copying the treemap back over
+    them. Only the areas of the screen that changed are updated.
     """
-    # First, clear the screen
-    pygame.draw.rect(screen, pygame.color.THECOLORS['black'],
-                     (0, 0, WIDTH, HEIGHT))
-
-    subscreen = screen.subsurface((0, 0, WIDTH, TREEMAP_HEIGHT))
-
-    # TODO: Uncomment this afer you have completed Task 2
-    for rect, colour in tree.get_rectangles():
-        # Note that the arguments are in the opposite order
-        pygame.draw.rect(subscreen, colour, rect)
-
-    # add the hover rectangle
+    if cache is None:
+        cache = DisplayCache()
+    changed = []
+    treemap_area = pygame.Rect(0, 0, WIDTH, TREEMAP_HEIGHT)
+
+    version = tree.get_version()
+    if cache.body is None or cache.tree is not tree or \
+            cache.version != version:
+        if cache.body is None:
+            cache.body = pygame.Surface(treemap_area.size, 0, screen)
+        cache.body.fill(pygame.color.THECOLORS['black'])
+
+        # TODO: Uncomment this afer you have completed Task 2
+        for rect, colour in tree.get_rectangles():
+            # Note that the arguments are in the opposite order
+            pygame.draw.rect(cache.body, colour, rect)
+
+        cache.tree = tree
+        cache.version = version
+        screen.blit(cache.body, treemap_area)
+        changed.append(treemap_area)
+    else:
+        # erase the old outlines
+        for area in cache.outlines:
+            screen.blit(cache.body, area, area)
+            changed.append(area)
+
+    subscreen = screen.subsurface(treemap_area)
+
+    # add the search matches and the hover rectangle
+    cache.outlines = []
+    if matches is not None:
+        # A hidden tree keeps the rectangle it had when it was last shown,
+        # so each match is outlined where it is displayed now.
+        outlined = set()
+        for match in matches:
+            rect = match.get_displayed_tree().rect
+            if rect[2] > 0 and rect[3] > 0 and rect not in outlined:
+                outlined.add(rect)
+                cache.outlines.append(pygame.draw.rect(
+                    subscreen, SEARCH_COLOUR, rect, 1))
     if selected_node is not None:
-        pygame.draw.rect(subscreen, (255, 255, 255), selected_node.rect, 5)
+        cache.outlines.append(pygame.draw.rect(
+            subscreen, (255, 255, 255), selected_node.rect, 5))
     if hover_node is not None:
-        pygame.draw.rect(subscreen, (255, 255, 255), hover_node.rect, 2)
+        cache.outlines.append(pygame.draw.rect(
+            subscreen, (255, 255, 255), hover_node.rect, 2))
+    changed.extend(cache.outlines)
 
     # TODO: Uncomment this after you have completed Task 2
-    _render_text(screen, _get_display_text(selected_node))
+    text = _get_display_text(selected_node)
+    if status != '':
+        text = (status + '  ' + text).rstrip()
+    if text != cache.text:
+        text_area = pygame.Rect(0, TREEMAP_HEIGHT, WIDTH, FONT_HEIGHT)
+        pygame.draw.rect(screen, pygame.color.THECOLORS['black'], text_area)
+        _render_text(screen, text)
+        cache.text = text
+        changed.append(text_area)
 
     # This must be called *after* all other pygame functions have run.
-    pygame.display.flip()
+    pygame.display.update(changed)
 
 
 def _render_text(screen: pygame.Surface, text: str) -> None:
     """Render text at the bottom of the display.
     """
-    # The font we want to use
-    font = pygame.font.SysFont(FONT_FAMILY, FONT_HEIGHT - 8)
-    text_surface = font.render(text, 1, pygame.color.THECOLORS['white'])
+    text_surface = _get_text_surface(text)
 
     # Where to render the text_surface
     text_pos = (0, HEIGHT - FONT_HEIGHT + 4)
     screen.blit(text_surface, text_pos)
 
 
-def event_loop(screen: pygame.Surface, tree: TMTree) -> None:
+@lru_cache(maxsize=None)
+def _get_font(family: str, size: int) -> pygame.font.Font:
+    """Return the system font <family> at <size>.
+
+    Looking up and loading a system font is slow, so each font is only loaded
+    once per session.
+    """
+    return pygame.font.SysFont(family, size)
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def _get_text_surface(text: str) -> pygame.Surface:
+    """Return <text> rendered in white in the font for the text display.
+
+    The most recently used surfaces are kept, so that the same text is not
+    rendered again every time it is displayed. They must not be modified.
+    """
+    # The font we want to use
+    font = _get_font(FONT_FAMILY, FONT_HEIGHT - 8)
+    return font.render(text, 1, pygame.color.THECOLORS['white'])
+
+
+def event_loop(screen: pygame.Surface, tree: TMTree,
+               scan: Optional[ProgressiveScan] = None, fps: int = FPS) -> None:
     """Respond to events (mouse clicks, key presses) and update the display.
 
     Note that the event loop is an *infinite loop*: it continually waits for
     the next event, determines the event's type, and then updates the state
     of the visualisation or the tree itself, updating the display if necessary.
     This loop ends only when the user closes the window.
+
+    The loop sleeps until an event arrives, and the display is only drawn
+    again when the selected node, the hover node, the tree's display version
+    or the status text has changed, at most <fps> times per second.
+
+    If <scan> is not None, the results of that background scan are added to
+    <tree>, and the treemap laid out again, at most once every SCAN_REFRESH
+    seconds until the scan is done.
+
+    The name index used for searches is built the first time the user
+    searches. It is built again, and the search repeated, when <scan> adds
+    trees to <tree>, so at most once every SCAN_REFRESH seconds, or when a
+    lazily listed <tree> lists another folder.
     """
     selected_node = None
+    hover_node = None
+    hover_state = None
+    drawn_state = None
+    query = ''
+    typing = False
+    searched = ''
+    matches = []
+    match_generation = 0
+    index = None
+    index_listings = None
+    lazy = isinstance(tree, LazyFileSystemTree)
+    cache = DisplayCache()
+    last_layout = time.perf_counter()
+    clock = pygame.time.Clock()
 
     while True:
-        # Wait for an event
-        event = pygame.event.poll()
-        if event.type == pygame.QUIT:
-            return
-
-        # get the hover position and the corresponding node
-        hover_node = tree.get_tree_at_position(pygame.mouse.get_pos())
-
-        if event.type == pygame.MOUSEBUTTONUP:
-            selected_node = \
-                _handle_click(event.button, event.pos, tree, selected_node)
-
-        elif event.type == pygame.KEYUP and selected_node is not None:
-            if event.key == pygame.K_UP:
-                # pass
-                # TODO: Uncomment once you have completed Task 4
-                selected_node.change_size(0.01)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
-
-            elif event.key == pygame.K_DOWN:
-                # pass
-                # TODO: Uncomment once you have completed Task 4
-                selected_node.change_size(-0.01)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
-
-            elif event.key == pygame.K_m:
-                # pass
-                # TODO: Uncomment once you have completed Task 4
-                selected_node.move(hover_node)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
-
-            elif event.key == pygame.K_e:
-                # pass
-                # TODO: Uncomment once you have completed Task 5
-                selected_node.expand()
-
-            elif event.key == pygame.K_a:
-                # pass
-                # TODO: Uncomment once you have completed Task 5
-                selected_node.expand_all()
-
-            elif event.key == pygame.K_c:
-                # pass
-                # TODO: Uncomment once you have completed Task 5
-                selected_node.collapse()
-
-            elif event.key == pygame.K_x:
-                # pass
-                # TODO: Uncomment once you have completed Task 5
-                selected_node.collapse_all()
+        # Wait for an event. While a scan is running, stop waiting in time
+        # to show its next results.
+        if scan is not None and not scan.is_done():
+            events = [pygame.event.wait(int(SCAN_REFRESH * 1000))]
+        else:
+            events = [pygame.event.wait()]
+        events.extend(pygame.event.get())
+
+        for event in events:
+            if event.type == pygame.QUIT:
+                return
+            elif event.type == pygame.VIDEOEXPOSE:
+                drawn_state = None
+                cache = DisplayCache()
+            elif typing and event.type in (pygame.KEYDOWN, pygame.KEYUP):
+                # The keys typed into a search are not commands.
+                if event.type == pygame.KEYDOWN:
+                    query, typing = _handle_search_key(event, query)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_SLASH:
+                query, typing = '', True
+            elif event.type == pygame.KEYDOWN and \
+                    event.key == pygame.K_ESCAPE:
+                query = ''
+            else:
+                selected_node = _handle_event(event, tree, selected_node)
+
+        # add any new scan results to the tree
+        status = ''
+        if scan is not None:
+            now = time.perf_counter()
+            if not scan.is_done() and now - last_layout >= SCAN_REFRESH:
+                if scan.poll():
+                    tree.update_rectangles((0, 0, WIDTH,
+                                            HEIGHT - FONT_HEIGHT),
+                                           incremental=True)
+                    index = None
+                last_layout = now
+            status = scan.progress_text()
+
+        # A lazily listed tree gains trees whenever one of its folders is
+        # listed.
+        if lazy and tree.get_listings() != index_listings:
+            index = None
+
+        # find the trees matching the search, indexing the tree again if it
+        # gained trees since the last search
+        if query == '':
+            if matches:
+                matches = []
+                match_generation += 1
+        elif query != searched or index is None:
+            if index is None:
+                index = NameIndex(tree)
+                if lazy:
+                    index_listings = tree.get_listings()
+            matches = index.search(query)
+            match_generation += 1
+        searched = query
+        if typing or query != '':
+            status = (status + '  ' +
+                      _get_search_text(query, typing, matches)).strip()
+
+        # get the hover position and the corresponding node, if either the
+        # mouse or the tree has changed
+        state = (pygame.mouse.get_pos(), tree.get_version())
+        if state != hover_state:
+            hover_node = tree.get_tree_at_position(state[0])
+            hover_state = state
 
         # Update display
-        render_display(screen, tree, selected_node, hover_node)
+        state = (selected_node, hover_node, tree.get_version(), status,
+                 match_generation)
+        if state != drawn_state:
+            render_display(screen, tree, selected_node, hover_node, status,
+                           cache, matches)
+            drawn_state = state
+            clock.tick(fps)
+
+
+def _handle_event(event: pygame.event.Event, tree: TMTree,
+                  selected_node: Optional[TMTree]) -> Optional[TMTree]:
+    """Update the visualisation or the tree in response to <event>, and
+    return the new selected node.
+    """
+    if event.type == pygame.MOUSEBUTTONUP:
+        selected_node = \
+            _handle_click(event.button, event.pos, tree, selected_node)
+
+    elif event.type == pygame.KEYUP and selected_node is not None:
+        if event.key == pygame.K_UP:
+            # pass
+            # TODO: Uncomment once you have completed Task 4
+            selected_node.change_size(0.01)
+            tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT),
+                                   incremental=True)
+
+        elif event.key == pygame.K_DOWN:
+            # pass
+            # TODO: Uncomment once you have completed Task 4
+            selected_node.change_size(-0.01)
+            tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT),
+                                   incremental=True)
+
+        elif event.key == pygame.K_m:
+            # pass
+            # TODO: Uncomment once you have completed Task 4
+            hover_node = tree.get_tree_at_position(pygame.mouse.get_pos())
+            selected_node.move(hover_node)
+            tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT),
+                                   incremental=True)
+
+        elif event.key == pygame.K_e:
+            # pass
+            # TODO: Uncomment once you have completed Task 5
+            selected_node.expand()
+
+        elif event.key == pygame.K_a:
+            # pass
+            # TODO: Uncomment once you have completed Task 5
+            selected_node.expand_all()
+
+        elif event.key == pygame.K_c:
+            # pass
+            # TODO: Uncomment once you have completed Task 5
+            selected_node.collapse()
+
+        elif event.key == pygame.K_x:
+            # pass
+            # TODO: Uncomment once you have completed Task 5
+            selected_node.collapse_all()
+
+    return selected_node
+
+
+def _handle_search_key(event: pygame.event.Event,
+                       query: str) -> Tuple[str, bool]:
+    """Return the search query after the key press <event>, and whether
+    the user is still typing it.
+    """
+    if event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+        return query, False
+    elif event.key == pygame.K_ESCAPE:
+        return '', False
+    elif event.key == pygame.K_BACKSPACE:
+        return query[:-1], True
+    elif event.unicode.isprintable():
+        return query + event.unicode, True
+    else:
+        return query, True
+
+
+def _get_search_text(query: str, typing: bool,
+                     matches: List[TMTree]) -> str:
+    """Return the display text of the search for <query>, which found
+    <matches>.
+    """
+    text = 'search: ' + query
+    if typing:
+        text += '_'
+    if len(matches) == SEARCH_LIMIT:
+        return text + '  ({}+ matches)'.format(SEARCH_LIMIT)
+    return text + '  ({} matches)'.format(len(matches))
 
 
 def _handle_click(button: int, pos: Tuple[int, int], tree: TMTree,
@@ -197,12 +496,46 @@ def _get_display_text(leaf: Optional[TMTree]) -> str:
         return leaf.get_path_string() + '  ({})'.format(leaf.data_size)
 
 
-def run_treemap_file_system(path: str) -> None:
+def run_treemap_file_system(path: str, workers: int = DEFAULT_WORKERS,
+                            snapshot: Optional[str] = None,
+                            lazy: bool = False,
+                            background: bool = False,
+                            compact: bool = False) -> None:
     """Run a treemap visualisation for the given path's file structure.
 
-    Precondition: <path> is a valid path to a file or folder.
+    The file system is scanned using <workers> threads, and the scan rate is
+    reported before the visualisation starts. If <snapshot> is not None,
+    unchanged folders are loaded from that snapshot file, which is then
+    updated for the next run. If <lazy> is True, folders are only listed
+    when they are first expanded.
+
+    If <background> is True, the visualisation starts right away and shows
+    the tree as it is scanned on background threads; <snapshot> and <lazy>
+    are then ignored.
+
+    If <compact> is True, the tree is kept in a CompactTree, which takes far
+    less memory for very large folders; <snapshot> and <lazy> are then
+    ignored.
+
+    Raise ValueError if both <background> and <compact> are True, since a
+    compact tree cannot be shown while it is being scanned.
+
+    Precondition: <path> is a valid path to a file or folder, and workers >= 1.
     """
-    file_tree = FileSystemTree(path)
+    if background and compact:
+        raise ValueError('a compact tree cannot be scanned in the background')
+    if compact:
+        file_tree, stats = compact_file_system(path, workers)
+        print('Scanned {}: {}'.format(path, stats))
+        run_visualisation(file_tree)
+        return
+    if background:
+        scan = ProgressiveScan(path, workers)
+        run_visualisation(scan.tree, scan)
+        print('Scanned {}: {}'.format(path, scan.stats))
+        return
+    file_tree, stats = scan_file_system(path, workers, snapshot, lazy)
+    print('Scanned {}: {}'.format(path, stats))
     run_visualisation(file_tree)
 
 
@@ -216,11 +549,22 @@ def run_treemap_papers() -> None:
     run_visualisation(paper_tree)
 
 
+def run_treemap_table(source: str, hierarchy: List[str], size: str) -> None:
+    """Run a treemap visualisation for the table in the CSV or JSON Lines
+    file <source>, grouped by the columns in <hierarchy> and sized by the
+    column <size>.
+    """
+    table_tree = load_table(source, hierarchy, size)
+    run_visualisation(table_tree)
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'pygame', 'tm_trees', 'papers'
+            'python_ta', 'typing', 'time', 'functools', 'pygame', 'tm_trees',
+            'papers', 'fs_scanner', 'layouts', 'compact_tree', 'tabular',
+            'name_search'
         ],
         'generated-members': 'pygame.*'
     })